@@ -10,10 +10,13 @@ import torchaudio
 import tarfile
 import tempfile
 import shutil
+import hashlib
+import json
 from sklearn.metrics import classification_report
 from torch.utils.data import DataLoader, Dataset as TorchDataset
 from tqdm import tqdm
 import gc
+from concurrent.futures import ThreadPoolExecutor
 from collections import Counter
 
 SEED = 42
@@ -22,6 +25,7 @@ np.random.seed(SEED)
 torch.manual_seed(SEED)
 
 dev = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+use_amp = dev.type == "cuda"
 
 class LargerConfig:
     def __init__(self):
@@ -68,63 +72,140 @@ class MelSpec(nn.Module):
         S_db = self.amp_to_db(S + 1e-10)
         return S_db
 
-def extract_files_to_disk(tar_path, extract_dir, max_files_per_label=50):
+class MelFrontend(nn.Module):
+    """Batched mel + per-sample normalization, run once per batch on the training device"""
+    def __init__(self, cfg):
+        super().__init__()
+        self.melspec = MelSpec(cfg)
+
+    @torch.no_grad()
+    def forward(self, wav):
+        if wav.dtype == torch.int16:
+            # Raw PCM batches are scaled here, after the transfer
+            wav = wav.float() / 32768.0
+        spec = self.melspec(wav.float())
+        # One fused reduction pass instead of separate mean() and std()
+        var, mean = torch.var_mean(spec, dim=(1, 2), keepdim=True, unbiased=False)
+        spec = (spec - mean) / (torch.sqrt(var) + 1e-6)
+        return spec.transpose(1, 2).contiguous()
+
+def save_resampled_npy(audio_path, sample_rate):
+    """Store a mono int16 copy at the training sample rate next to the audio file"""
+    wav, sr = torchaudio.load(audio_path)
+    if sr != sample_rate:
+        wav = torchaudio.functional.resample(wav, sr, sample_rate)
+    wav = wav.mean(0) if wav.shape[0] > 1 else wav[0]
+    pcm = (wav.clamp(-1.0, 1.0) * 32767.0).round().to(torch.int16)
+    npy_path = os.path.splitext(audio_path)[0] + '.npy'
+    np.save(npy_path, pcm.numpy())
+    return npy_path
+
+COPY_BUFFER = 1024 * 1024
+
+def is_compressed_tar(tar_path):
+    """Check the gzip/bz2/xz magic bytes (the dataset archive has no extension)"""
+    with open(tar_path, 'rb') as f:
+        magic = f.read(6)
+    return magic.startswith((b'\x1f\x8b', b'BZh', b'\xfd7zXZ'))
+
+def copy_plain_member(tar_path, member, save_path):
+    """Copy one member of an uncompressed tar using its own file handle (thread-safe)"""
+    with open(tar_path, 'rb') as src, open(save_path, 'wb', buffering=COPY_BUFFER) as dst:
+        src.seek(member.offset_data)
+        remaining = member.size
+        while remaining > 0:
+            chunk = src.read(min(COPY_BUFFER, remaining))
+            if not chunk:
+                break
+            dst.write(chunk)
+            remaining -= len(chunk)
+
+def extract_files_to_disk(tar_path, extract_dir, max_files_per_label=50, sample_rate=16000):
     """Extract files to disk for faster training"""
     print(f"Extracting files from {tar_path} to {extract_dir}...")
     
     # Create extraction directory
     os.makedirs(extract_dir, exist_ok=True)
+    compressed = is_compressed_tar(tar_path)
     
-    # Keep tar file open for entire extraction
-    with tarfile.open(tar_path, 'r:gz') as tar:
-        file_list = tar.getnames()
-        
-        # Get audio files
-        audio_files = [f for f in file_list if f.endswith('.wav') or f.endswith('.flac')]
-        
-        # Group by label
-        files_by_label = {}
-        for file_path in audio_files:
-            path_parts = file_path.split('/')
-            if len(path_parts) >= 6:
-                label = path_parts[-2]
-                if label not in files_by_label:
-                    files_by_label[label] = []
-                files_by_label[label].append(file_path)
-        
-        print(f"Found labels: {list(files_by_label.keys())}")
-        for label, files in files_by_label.items():
-            print(f"  {label}: {len(files)} files")
-        
-        # Extract files, limiting per label
-        extracted_files = []
-        for label, files in files_by_label.items():
-            # Sample files if too many
-            if len(files) > max_files_per_label:
-                files = random.sample(files, max_files_per_label)
-            
-            print(f"Extracting {len(files)} files for label '{label}'...")
-            label_dir = os.path.join(extract_dir, label)
-            os.makedirs(label_dir, exist_ok=True)
-            
-            for i, file_path in enumerate(tqdm(files, desc=f"Extracting {label}")):
+    # Metadata pass: list the archive once
+    with tarfile.open(tar_path, 'r:*') as tar:
+        members = {m.name: m for m in tar.getmembers() if m.isfile()}
+    
+    # Get audio files
+    audio_files = [f for f in members if f.endswith('.wav') or f.endswith('.flac')]
+    
+    # Group by label
+    files_by_label = {}
+    for file_path in audio_files:
+        path_parts = file_path.split('/')
+        if len(path_parts) >= 6:
+            label = path_parts[-2]
+            if label not in files_by_label:
+                files_by_label[label] = []
+            files_by_label[label].append(file_path)
+    
+    print(f"Found labels: {list(files_by_label.keys())}")
+    for label, files in files_by_label.items():
+        print(f"  {label}: {len(files)} files")
+    
+    # Pick the files to extract, limiting per label
+    targets = {}
+    for label, files in files_by_label.items():
+        # Sample files if too many
+        if len(files) > max_files_per_label:
+            files = random.sample(files, max_files_per_label)
+        print(f"Selected {len(files)} files for label '{label}'")
+        os.makedirs(os.path.join(extract_dir, label), exist_ok=True)
+        for file_path in files:
+            targets[file_path] = label
+    
+    def save_path_for(file_path):
+        return os.path.join(extract_dir, targets[file_path], os.path.basename(file_path))
+    
+    def finish(file_path):
+        # Resample once here instead of on every __getitem__
+        save_path = save_path_for(file_path)
+        save_resampled_npy(save_path, sample_rate)
+        return save_path, targets[file_path]
+    
+    extracted_files = []
+    pbar = tqdm(total=len(targets), desc="Extracting")
+    if compressed:
+        # Compressed archives can't seek cheaply, so stream every member exactly once
+        # and stop as soon as all targets have been written
+        remaining = set(targets)
+        with tarfile.open(tar_path, 'r|*') as stream:
+            for member in stream:
+                if member.name not in remaining or not member.isfile():
+                    continue
                 try:
-                    # Extract file
-                    member = tar.getmember(file_path)
-                    audio_data = tar.extractfile(member).read()
-                    
-                    # Save to disk
-                    filename = os.path.basename(file_path)
-                    save_path = os.path.join(label_dir, filename)
-                    
-                    with open(save_path, 'wb') as f:
-                        f.write(audio_data)
-                    
-                    extracted_files.append((save_path, label))
-                    
+                    with stream.extractfile(member) as src, \
+                            open(save_path_for(member.name), 'wb', buffering=COPY_BUFFER) as dst:
+                        shutil.copyfileobj(src, dst, COPY_BUFFER)
+                    extracted_files.append(finish(member.name))
                 except Exception as e:
-                    print(f"Error extracting {file_path}: {e}")
-                    continue
+                    print(f"Error extracting {member.name}: {e}")
+                remaining.discard(member.name)
+                pbar.update(1)
+                if not remaining:
+                    break
+    else:
+        # Plain tars are random-access: copy members in parallel with per-thread handles
+        def extract_one(file_path):
+            try:
+                copy_plain_member(tar_path, members[file_path], save_path_for(file_path))
+                return finish(file_path)
+            except Exception as e:
+                print(f"Error extracting {file_path}: {e}")
+                return None
+        
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+            for result in pool.map(extract_one, targets):
+                if result is not None:
+                    extracted_files.append(result)
+                pbar.update(1)
+    pbar.close()
     
     print(f"Extracted {len(extracted_files)} files to {extract_dir}")
     return extracted_files
@@ -141,143 +222,302 @@ def get_extracted_files(extract_dir):
                     files.append((file_path, label))
     return files
 
+def mel_cache_key(cfg, file_list):
+    """Hash the feature config and file list so stale caches are never reused"""
+    fields = {
+        "sample_rate": cfg.sample_rate,
+        "n_mels": cfg.n_mels,
+        "win_length": cfg.win_length,
+        "hop_length": cfg.hop_length,
+        "fmin": cfg.fmin,
+        "fmax": cfg.fmax,
+        "window_seconds": cfg.window_seconds,
+        "files": [file_path for file_path, _ in file_list],
+    }
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
 class ExtractedDataset(TorchDataset):
-    def __init__(self, cfg, file_list):
+    def __init__(self, cfg, file_list, mel_cache_dir=None):
         self.cfg = cfg
         self.file_list = file_list
-        self.melspec = MelSpec(cfg)
+        self.target_length = int(cfg.window_seconds * cfg.sample_rate)
+        
+        # One target tensor per raw label, built once instead of per __getitem__
+        self._label_to_y = {}
+        for _, label in file_list:
+            if label not in self._label_to_y:
+                self._label_to_y[label] = torch.from_numpy(self._label_vector(label))
+        self._indexed_files = [(file_path, self._label_to_y[label]) for file_path, label in file_list]
+        
+        # Pre-resampled int16 copies written by extract_files_to_disk, when present
+        self.npy_paths = []
+        for file_path, _ in file_list:
+            npy_path = os.path.splitext(file_path)[0] + '.npy'
+            self.npy_paths.append(npy_path if os.path.exists(npy_path) else None)
+        
+        # Mel-spectrograms are deterministic, so compute them once and memory-map them
+        self.cache_path = None
+        self.mmap = None
+        if mel_cache_dir is not None:
+            self.cache_path = self._build_mel_cache(mel_cache_dir)
         
         print(f"Extracted dataset size: {len(self.file_list)}")
 
     def __len__(self):
         return len(self.file_list)
 
+    def _spec_shape(self):
+        n_frames = 1 + self.target_length // self.cfg.hop_length
+        return n_frames, self.cfg.n_mels
+
+    def _build_mel_cache(self, mel_cache_dir):
+        """Precompute all mel-spectrograms into a single bfloat16 memmap (stored as int16 bits)"""
+        os.makedirs(mel_cache_dir, exist_ok=True)
+        key = mel_cache_key(self.cfg, self.file_list)
+        cache_path = os.path.join(mel_cache_dir, f"mel_{key}.bf16")
+        
+        # Targets come from _label_to_y, so only the spectrograms are cached
+        if os.path.exists(cache_path):
+            print(f"Using cached mel-spectrograms: {cache_path}")
+            return cache_path
+        
+        shape = (len(self.file_list),) + self._spec_shape()
+        tmp_path = cache_path + ".tmp"
+        mmap = np.memmap(tmp_path, dtype=np.int16, mode='w+', shape=shape)
+        frontend = MelFrontend(self.cfg).to(dev)
+        
+        for idx in tqdm(range(len(self.file_list)), desc="Caching mels"):
+            try:
+                wav = self._load_wav(idx).unsqueeze(0).to(dev)
+                mmap[idx] = frontend(wav)[0].to(torch.bfloat16).view(torch.int16).cpu().numpy()
+            except Exception as e:
+                print(f"Error caching sample {idx}: {e}")
+                mmap[idx] = 0
+        
+        mmap.flush()
+        del mmap
+        os.replace(tmp_path, cache_path)
+        print(f"Cached {len(self.file_list)} mel-spectrograms to {cache_path}")
+        return cache_path
+
+    def _load_wav(self, idx):
+        npy_path = self.npy_paths[idx]
+        if npy_path is not None:
+            pcm = np.load(npy_path, mmap_mode='r')[:self.target_length]
+            wav = torch.from_numpy(pcm.astype(np.float32)) / 32768.0
+            if wav.shape[-1] < self.target_length:
+                wav = torch.nn.functional.pad(wav, (0, self.target_length - wav.shape[-1]))
+            return wav
+        
+        # Load audio directly from disk
+        file_path, _ = self.file_list[idx]
+        wav, sr = torchaudio.load(file_path)
+        
+        # Convert to mono if stereo
+        if wav.shape[0] > 1:
+            wav = wav.mean(dim=0, keepdim=True)
+        
+        # Resample if needed
+        if sr != self.cfg.sample_rate:
+            wav = torchaudio.functional.resample(wav, sr, self.cfg.sample_rate)
+        
+        # Remove channel dimension if present
+        if wav.ndim > 1:
+            wav = wav.squeeze(0)
+        
+        # Pad or truncate to window size
+        if wav.shape[-1] < self.target_length:
+            wav = torch.nn.functional.pad(wav, (0, self.target_length - wav.shape[-1]))
+        else:
+            wav = wav[:self.target_length]
+        return wav
+
+    def _load_pcm(self, idx):
+        """Window as int16 PCM: half the bytes of float32 and, unlike fp16, no rounding"""
+        npy_path = self.npy_paths[idx]
+        if npy_path is not None:
+            pcm = torch.from_numpy(np.array(np.load(npy_path, mmap_mode='r')[:self.target_length]))
+            if pcm.shape[-1] < self.target_length:
+                pcm = torch.nn.functional.pad(pcm, (0, self.target_length - pcm.shape[-1]))
+            return pcm
+        # Exact for 16-bit sources at the training rate; otherwise the same quantization
+        # extract_files_to_disk applies when it writes the .npy copies
+        wav = self._load_wav(idx)
+        return (wav * 32768.0).round().clamp(-32768, 32767).to(torch.int16)
+
+    def _label_vector(self, label):
+        y = np.zeros(len(self.cfg.label_names), dtype=np.float32)
+        
+        if label in self.cfg.label_mapping:
+            mapped_label = self.cfg.label_mapping[label]
+            if mapped_label in self.cfg.label_names:
+                y[self.cfg.label_names.index(mapped_label)] = 1.0
+        return y
+
     def __getitem__(self, idx):
         try:
-            file_path, label = self.file_list[idx]
-            
-            # Load audio directly from disk
-            wav, sr = torchaudio.load(file_path)
-            
-            # Convert to mono if stereo
-            if wav.shape[0] > 1:
-                wav = wav.mean(dim=0, keepdim=True)
-            
-            # Resample if needed
-            if sr != self.cfg.sample_rate:
-                wav = torchaudio.functional.resample(wav, sr, self.cfg.sample_rate)
+            _, y = self._indexed_files[idx]
             
-            # Remove channel dimension if present
-            if wav.ndim > 1:
-                wav = wav.squeeze(0)
-            
-            # Pad or truncate to window size
-            target_length = int(self.cfg.window_seconds * self.cfg.sample_rate)
-            if wav.shape[-1] < target_length:
-                wav = torch.nn.functional.pad(wav, (0, target_length - wav.shape[-1]))
+            if self.cache_path is not None:
+                # Open lazily so each DataLoader worker maps the file itself
+                if self.mmap is None:
+                    shape = (len(self.file_list),) + self._spec_shape()
+                    self.mmap = np.memmap(self.cache_path, dtype=np.int16, mode='r', shape=shape)
+                # Stays bfloat16 until it is on the device, halving IPC and H2D bytes
+                spec = torch.from_numpy(np.array(self.mmap[idx])).view(torch.bfloat16)
             else:
-                wav = wav[:target_length]
-            
-            # Create mel spectrogram
-            spec = self.melspec(wav)
-            spec = (spec - spec.mean()) / (spec.std() + 1e-6)
-            spec = spec.transpose(0, 1).contiguous()
-            
-            # Create labels
-            y = np.zeros(len(self.cfg.label_names), dtype=np.float32)
-            
-            if label in self.cfg.label_mapping:
-                mapped_label = self.cfg.label_mapping[label]
-                if mapped_label in self.cfg.label_names:
-                    y[self.cfg.label_names.index(mapped_label)] = 1.0
+                # Mel is computed per batch on the device by MelFrontend, which also scales the PCM
+                spec = self._load_pcm(idx)
             
-            return spec.float(), torch.from_numpy(y)
+            return spec, y
             
         except Exception as e:
             print(f"Error processing sample {idx}: {e}")
             # Return a dummy sample
-            spec = torch.zeros(100, self.cfg.n_mels)
+            if self.cache_path is not None:
+                spec = torch.zeros(self._spec_shape(), dtype=torch.bfloat16)
+            else:
+                spec = torch.zeros(self.target_length, dtype=torch.int16)
             y = torch.zeros(len(self.cfg.label_names))
-            return spec.float(), y
+            return spec, y
+
+def DSConvBlock(channels, dilation):
+    """Dilated depthwise-separable Conv1d block"""
+    return nn.Sequential(
+        nn.Conv1d(channels, channels, kernel_size=3, padding=dilation, dilation=dilation, groups=channels),
+        nn.Conv1d(channels, channels, kernel_size=1),
+        nn.BatchNorm1d(channels),
+        nn.ReLU(inplace=True),
+    )
 
-class CNNLSTMMultiLabel(nn.Module):
+class CNNAttnMultiLabel(nn.Module):
+    """CNN front end, dilated separable conv sequence model and attention pooling over time"""
     def __init__(self, n_mels, num_labels):
         super().__init__()
+        # 2D convs over (T, n_mels) so cuDNN can use its NHWC (channels_last) kernels;
+        # the first kernel spans all mel bins, which matches the old Conv1d exactly
+        # BatchNorm sits directly after each conv so it can be folded into it at inference
         self.conv = nn.Sequential(
-            nn.Conv1d(n_mels, 128, kernel_size=5, padding=2),
+            nn.Conv2d(1, 128, kernel_size=(5, n_mels), padding=(2, 0)),
+            nn.BatchNorm2d(128),
             nn.ReLU(inplace=True),
-            nn.BatchNorm1d(128),
-            nn.Conv1d(128, 128, kernel_size=5, padding=2),
+            nn.Conv2d(128, 128, kernel_size=(5, 1), padding=(2, 0)),
+            nn.BatchNorm2d(128),
             nn.ReLU(inplace=True),
-            nn.BatchNorm1d(128),
         )
-        self.lstm = nn.LSTM(input_size=128, hidden_size=128, num_layers=1, batch_first=True, bidirectional=True)
+        # Sequence model: dilated separable convs (receptive field grows 1-2-4) in place
+        # of the bidirectional LSTM, so every frame is processed in parallel
+        self.seq = nn.Sequential(
+            DSConvBlock(128, dilation=1),
+            DSConvBlock(128, dilation=2),
+            DSConvBlock(128, dilation=4),
+        )
+        self.attn = nn.Linear(128, 1)
         self.classifier = nn.Sequential(
-            nn.Linear(256, 128),
+            nn.Linear(128, 128),
             nn.ReLU(inplace=True),
             nn.Dropout(0.2),
             nn.Linear(128, num_labels),
         )
 
     def forward(self, x):
-        x = x.transpose(1, 2)
+        x = x.unsqueeze(1).contiguous(memory_format=torch.channels_last)
         x = self.conv(x)
+        x = self.seq(x.squeeze(-1))
         x = x.transpose(1, 2)
-        out, _ = self.lstm(x)
-        pooled = out.mean(dim=1)
+        # Attention pooling over time
+        attn = torch.softmax(self.attn(x), dim=1)
+        pooled = (x * attn).sum(dim=1)
         logits = self.classifier(pooled)
         return logits
 
 def collate_fn(batch):
+    # Every sample comes from the same fixed window (waveform or spectrogram),
+    # so the batch can be stacked directly without padding
     specs, ys = zip(*batch)
-    max_T = max(s.shape[0] for s in specs)
-    n_mels = specs[0].shape[1]
-    xs = torch.zeros(len(specs), max_T, n_mels)
-    for i, s in enumerate(specs):
-        xs[i, :s.shape[0]] = s
-    ys = torch.stack(ys).float()
-    return xs, ys
-
-def train_one_epoch(model, loader, optim_, loss_fn):
+    return torch.stack(specs, 0), torch.stack(ys, 0).float()
+
+class CUDAPrefetcher:
+    """Copy the next batch to the device on a side stream while the current batch runs"""
+    def __init__(self, loader):
+        self.loader = iter(loader)
+        self.stream = torch.cuda.Stream() if dev.type == "cuda" else None
+        self.preload()
+
+    def preload(self):
+        try:
+            self.next_x, self.next_y = next(self.loader)
+        except StopIteration:
+            self.next_x, self.next_y = None, None
+            return
+        
+        if self.stream is None:
+            self.next_x = self.next_x.to(dev)
+            self.next_y = self.next_y.to(dev)
+            return
+        
+        with torch.cuda.stream(self.stream):
+            self.next_x = self.next_x.to(dev, non_blocking=True)
+            self.next_y = self.next_y.to(dev, non_blocking=True)
+
+    def next(self):
+        if self.stream is not None:
+            torch.cuda.current_stream().wait_stream(self.stream)
+        x, y = self.next_x, self.next_y
+        if x is not None and self.stream is not None:
+            # Tell the allocator these tensors are now used on the main stream
+            x.record_stream(torch.cuda.current_stream())
+            y.record_stream(torch.cuda.current_stream())
+        self.preload()
+        return x, y
+
+def seed_worker(worker_id):
+    # Give each DataLoader worker its own numpy/random stream derived from the torch seed
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+def train_one_epoch(model, loader, optim_, loss_fn, frontend, scaler):
     model.train()
     total = 0.0
-    for x, y in tqdm(loader, desc="train", leave=False):
-        x = x.to(dev)
-        y = y.to(dev)
+    prefetcher = CUDAPrefetcher(tqdm(loader, desc="train", leave=False))
+    x, y = prefetcher.next()
+    while x is not None:
+        x = frontend(x) if x.dim() == 2 else x.float()
         optim_.zero_grad(set_to_none=True)
-        logits = model(x)
-        loss = loss_fn(logits, y)
-        loss.backward()
-        optim_.step()
+        with torch.cuda.amp.autocast(enabled=use_amp, dtype=torch.float16):
+            logits = model(x)
+            loss = loss_fn(logits, y)
+        scaler.scale(loss).backward()
+        scaler.step(optim_)
+        scaler.update()
         total += float(loss.item()) * x.size(0)
-        
-        # Clear memory
-        del x, y, logits, loss
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        x, y = prefetcher.next()
     
     return total / max(1, len(loader.dataset))
 
-def evaluate(model, loader):
+def evaluate(model, loader, frontend):
     model.eval()
-    preds = []
-    trues = []
+    # Preallocated on the device and copied back once at the end
+    N = len(loader.dataset)
+    num_labels = len(loader.dataset.cfg.label_names)
+    preds = torch.empty(N, num_labels, device=dev)
+    trues = torch.empty_like(preds)
+    off = 0
     with torch.no_grad():
-        for x, y in tqdm(loader, desc="eval", leave=False):
-            x = x.to(dev)
-            logits = model(x)
-            p = torch.sigmoid(logits).cpu().numpy()
-            preds.append(p)
-            trues.append(y.numpy())
-            
-            # Clear memory
-            del x, logits, p
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
+        prefetcher = CUDAPrefetcher(tqdm(loader, desc="eval", leave=False))
+        x, y = prefetcher.next()
+        while x is not None:
+            x = frontend(x) if x.dim() == 2 else x.float()
+            with torch.cuda.amp.autocast(enabled=use_amp, dtype=torch.float16):
+                logits = model(x)
+            bsz = x.size(0)
+            preds[off:off + bsz].copy_(torch.sigmoid(logits.float()))
+            trues[off:off + bsz].copy_(y)
+            off += bsz
+            x, y = prefetcher.next()
     
-    preds = np.concatenate(preds, axis=0)
-    trues = np.concatenate(trues, axis=0)
-    return preds, trues
+    return preds[:off].cpu().numpy(), trues[:off].cpu().numpy()
 
 def main():
     parser = argparse.ArgumentParser(description="Larger Dataset Trainer")
@@ -287,6 +527,7 @@ def main():
     parser.add_argument('--max-files-per-label', type=int, default=50, help='Maximum files per label to extract')
     parser.add_argument('--extract-dir', type=str, default='./extracted_larger', help='Directory to extract files to')
     parser.add_argument('--skip-extract', action='store_true', help='Skip extraction if files already exist')
+    parser.add_argument('--mel-cache-dir', type=str, default=None, help='Directory to cache precomputed mel-spectrograms')
     args = parser.parse_args()
 
     cfg = LargerConfig()
@@ -305,7 +546,7 @@ def main():
         # Extract files if needed
         if not args.skip_extract or not os.path.exists(args.extract_dir):
             print(f"\n📦 Extracting files...")
-            extracted_files = extract_files_to_disk(test_path, args.extract_dir, args.max_files_per_label)
+            extracted_files = extract_files_to_disk(test_path, args.extract_dir, args.max_files_per_label, cfg.sample_rate)
         else:
             print(f"\n📁 Using existing extracted files...")
             extracted_files = get_extracted_files(args.extract_dir)
@@ -325,15 +566,29 @@ def main():
         print(f"\nSplit into {len(train_files)} training and {len(val_files)} validation samples")
         
         # Create datasets
-        train_ds = ExtractedDataset(cfg, train_files)
-        val_ds = ExtractedDataset(cfg, val_files)
+        train_ds = ExtractedDataset(cfg, train_files, args.mel_cache_dir)
+        val_ds = ExtractedDataset(cfg, val_files, args.mel_cache_dir)
 
-        train_loader = DataLoader(train_ds, batch_size=cfg.batch_size, shuffle=True, num_workers=2, collate_fn=collate_fn)
-        val_loader = DataLoader(val_ds, batch_size=cfg.batch_size, shuffle=False, num_workers=2, collate_fn=collate_fn)
+        # Page-locked batches let the non_blocking copies overlap with compute
+        loader_kwargs = dict(
+            num_workers=min(os.cpu_count() or 1, 8),
+            collate_fn=collate_fn,
+            worker_init_fn=seed_worker,
+            pin_memory=torch.cuda.is_available(),
+            persistent_workers=True,
+            prefetch_factor=4,
+        )
+        train_loader = DataLoader(train_ds, batch_size=cfg.batch_size, shuffle=True, **loader_kwargs)
+        val_loader = DataLoader(val_ds, batch_size=cfg.batch_size, shuffle=False, **loader_kwargs)
 
-        model = CNNLSTMMultiLabel(n_mels=cfg.n_mels, num_labels=len(cfg.label_names)).to(dev)
+        frontend = MelFrontend(cfg).to(dev)
+        net = CNNAttnMultiLabel(n_mels=cfg.n_mels, num_labels=len(cfg.label_names)).to(dev)
+        net = net.to(memory_format=torch.channels_last)
+        # Scripted module shares parameters with net, which is kept for checkpoints
+        model = torch.jit.script(net)
         loss_fn = nn.BCEWithLogitsLoss()
         optimizer = optim.Adam(model.parameters(), lr=cfg.lr)
+        scaler = torch.cuda.amp.GradScaler(enabled=use_amp)
 
         print(f"\n🎯 Training with {len(train_files)} training samples and {len(val_files)} validation samples...")
         best_val_loss = float('inf')
@@ -342,36 +597,36 @@ def main():
             print(f"\n📊 Epoch {epoch}/{cfg.epochs}")
             
             # Training
-            train_loss = train_one_epoch(model, train_loader, optimizer, loss_fn)
+            train_loss = train_one_epoch(model, train_loader, optimizer, loss_fn, frontend, scaler)
             print(f"Training loss: {train_loss:.4f}")
             
             # Validation
-            val_preds, val_trues = evaluate(model, val_loader)
+            val_preds, val_trues = evaluate(model, val_loader, frontend)
             val_loss = nn.BCEWithLogitsLoss()(torch.from_numpy(val_preds), torch.from_numpy(val_trues)).item()
             print(f"Validation loss: {val_loss:.4f}")
             
             # Save best model
             if val_loss < best_val_loss:
                 best_val_loss = val_loss
-                torch.save(model.state_dict(), 'best_larger_model.pth')
+                torch.save(net.state_dict(), 'best_larger_model.pth')
                 print("Saved best model!")
             
             # Save epoch model
-            torch.save(model.state_dict(), f'larger_model_epoch_{epoch}.pth')
+            torch.save(net.state_dict(), f'larger_model_epoch_{epoch}.pth')
             print(f"Saved model for epoch {epoch}!")
             
             # Clear memory
             gc.collect()
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
 
         print("\nFinal evaluation...")
-        val_preds, val_trues = evaluate(model, val_loader)
+        # Training is over, so freeze once: weights (and Conv -> BN pairs) fold into constants
+        frozen = torch.jit.optimize_for_inference(torch.jit.freeze(model.eval()))
+        val_preds, val_trues = evaluate(frozen, val_loader, frontend)
         bin_preds = (val_preds >= 0.5).astype(np.int32)
         print(classification_report(val_trues, bin_preds, target_names=cfg.label_names, zero_division=0))
 
         # Save final model
-        torch.save(model.state_dict(), 'final_larger_model.pth')
+        torch.save(net.state_dict(), 'final_larger_model.pth')
         print("Final model saved as 'final_larger_model.pth'")
         print("Best model saved as 'best_larger_model.pth'")
         
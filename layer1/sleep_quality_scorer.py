@@ -9,9 +9,55 @@ A comprehensive system for calculating sleep quality scores based on:
 Outputs a normalized score from 0-100.
 """
 
+from types import MappingProxyType
 from typing import Dict, Optional, Tuple
 from dataclasses import dataclass
 
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to plain Python
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+
+@njit(cache=True, fastmath=True)
+def _score(duration, snore, apnea, cough, sleep_r, env_r, w,
+           thr_s, thr_a, thr_c, opt_min, opt_max):
+    """Scalar scoring kernel; returns (overall, duration, events, sleep_rating, environment)"""
+    # Duration score
+    if duration <= 0:
+        duration_score = 0.0
+    elif duration < opt_min:
+        duration_score = max(0.0, 100.0 - (opt_min - duration) / opt_min * 100.0)
+    elif duration > opt_max:
+        duration_score = max(0.0, 100.0 - min(1.0, (duration - opt_max) / 3.0) * 100.0)
+    else:
+        duration_score = 100.0
+    
+    # Events score
+    total_penalty = (min(1.0, snore / thr_s) * 0.3 +
+                     min(1.0, apnea / thr_a) * 0.5 +
+                     min(1.0, cough / thr_c) * 0.2)
+    events_score = max(0.0, 100.0 - total_penalty * 100.0)
+    
+    # Ratings on a 1-10 scale
+    sleep_rating_score = sleep_r / 10.0 * 100.0
+    environment_score = env_r / 10.0 * 100.0
+    
+    overall = (duration_score * w[0] + events_score * w[1] +
+               sleep_rating_score * w[2] + environment_score * w[3])
+    overall = max(0.0, min(100.0, overall))
+    return overall, duration_score, events_score, sleep_rating_score, environment_score
+
+
+# Compile once at import so the first API call doesn't pay the JIT cost
+_score(8.0, 0.0, 0.0, 0.0, 5.0, 5.0, np.full(4, 0.25, dtype=np.float32),
+       50.0, 10.0, 20.0, 7.0, 9.0)
+
 
 @dataclass
 class SleepEventData:
@@ -39,6 +85,16 @@ class SleepQualityScorer:
     4. Self-reported environment quality (1-10 scale)
     """
     
+    # Shared, read-only defaults (already known to sum to 1.0)
+    _DEFAULT_WEIGHTS = MappingProxyType({
+        'duration': 0.25,      # Sleep duration weight
+        'events': 0.25,        # Sleep events weight (negative impact)
+        'sleep_rating': 0.30,  # Self-reported sleep quality weight
+        'environment': 0.20    # Environment rating weight
+    })
+    _DEFAULT_W = np.array([0.25, 0.25, 0.30, 0.20], dtype=np.float32)
+    _DEFAULT_W.setflags(write=False)
+    
     def __init__(self, weights: Optional[Dict[str, float]] = None):
         """
         Initialize the scorer with custom weights or use defaults.
@@ -46,17 +102,24 @@ class SleepQualityScorer:
         Args:
             weights: Dictionary of weights for each factor. If None, uses defaults.
         """
-        self.weights = weights or {
-            'duration': 0.25,      # Sleep duration weight
-            'events': 0.25,        # Sleep events weight (negative impact)
-            'sleep_rating': 0.30,  # Self-reported sleep quality weight
-            'environment': 0.20    # Environment rating weight
-        }
-        
-        # Validate weights sum to 1.0
-        total_weight = sum(self.weights.values())
-        if abs(total_weight - 1.0) > 1e-6:
-            raise ValueError(f"Weights must sum to 1.0, got {total_weight}")
+        if weights is None:
+            self.weights = self._DEFAULT_WEIGHTS
+            self._w = self._DEFAULT_W
+        else:
+            self.weights = weights
+            
+            # Validate weights sum to 1.0
+            total_weight = sum(self.weights.values())
+            if abs(total_weight - 1.0) > 1e-6:
+                raise ValueError(f"Weights must sum to 1.0, got {total_weight}")
+            
+            # Weight vector in component order for the batch path
+            self._w = np.array([
+                self.weights['duration'],
+                self.weights['events'],
+                self.weights['sleep_rating'],
+                self.weights['environment']
+            ], dtype=np.float32)
         
         # Optimal sleep duration range (in hours)
         self.optimal_duration_min = 7.0
@@ -149,23 +212,21 @@ class SleepQualityScorer:
         Returns:
             Tuple of (overall_score, component_scores)
         """
-        # Calculate individual component scores
-        duration_score = self.calculate_duration_score(duration_hours)
-        events_score = self.calculate_events_score(events)
-        sleep_rating_score = self.normalize_rating(self_reported.sleep_rating)
-        environment_score = self.normalize_rating(self_reported.environment_rating)
-        
-        # Calculate weighted overall score
-        overall_score = (
-            duration_score * self.weights['duration'] +
-            events_score * self.weights['events'] +
-            sleep_rating_score * self.weights['sleep_rating'] +
-            environment_score * self.weights['environment']
+        overall_score, duration_score, events_score, sleep_rating_score, environment_score = _score(
+            float(duration_hours),
+            float(events.snore_count),
+            float(events.apnea_count),
+            float(events.cough_count),
+            float(self_reported.sleep_rating),
+            float(self_reported.environment_rating),
+            self._w,
+            float(self.event_thresholds['snore']),
+            float(self.event_thresholds['apnea']),
+            float(self.event_thresholds['cough']),
+            self.optimal_duration_min,
+            self.optimal_duration_max
         )
         
-        # Ensure score is within 0-100 range
-        overall_score = max(0, min(100, overall_score))
-        
         component_scores = {
             'duration': duration_score,
             'events': events_score,
@@ -176,6 +237,56 @@ class SleepQualityScorer:
         
         return overall_score, component_scores
     
+    def calculate_batch(
+        self,
+        durations: np.ndarray,
+        snore: np.ndarray,
+        apnea: np.ndarray,
+        cough: np.ndarray,
+        sleep_r: np.ndarray,
+        env_r: np.ndarray
+    ) -> np.ndarray:
+        """
+        Vectorized overall score for many nights at once.
+        
+        Same formula as calculate_sleep_quality_score, applied to columnar
+        arrays of equal length.
+        
+        Args:
+            durations: Sleep durations in hours
+            snore: Snore counts
+            apnea: Apnea counts
+            cough: Cough counts
+            sleep_r: Self-reported sleep ratings (1-10)
+            env_r: Self-reported environment ratings (1-10)
+            
+        Returns:
+            Array of overall scores from 0-100
+        """
+        durations = np.asarray(durations, dtype=np.float32)
+        
+        # Duration: linear penalty below the optimal range, capped penalty above it
+        short = (self.optimal_duration_min - durations) / self.optimal_duration_min
+        long = np.minimum(1.0, (durations - self.optimal_duration_max) / 3.0)
+        penalty = np.where(durations < self.optimal_duration_min, short,
+                           np.where(durations > self.optimal_duration_max, long, 0.0))
+        duration_score = np.where(durations <= 0, 0.0, np.clip(100 - penalty * 100, 0, None))
+        
+        # Events: weighted, capped penalties per event type
+        total_penalty = (
+            np.minimum(np.asarray(snore, dtype=np.float32) / self.event_thresholds['snore'], 1.0) * 0.3 +
+            np.minimum(np.asarray(apnea, dtype=np.float32) / self.event_thresholds['apnea'], 1.0) * 0.5 +
+            np.minimum(np.asarray(cough, dtype=np.float32) / self.event_thresholds['cough'], 1.0) * 0.2
+        )
+        events_score = np.clip(100 - total_penalty * 100, 0, None)
+        
+        # Ratings: 1-10 scale to 0-100
+        sleep_rating_score = np.asarray(sleep_r, dtype=np.float32) * 10.0
+        environment_score = np.asarray(env_r, dtype=np.float32) * 10.0
+        
+        components = np.stack([duration_score, events_score, sleep_rating_score, environment_score], axis=-1)
+        return np.clip(components.astype(np.float32) @ self._w, 0, 100)
+    
     def get_quality_category(self, score: float) -> str:
         """
         Categorize sleep quality based on score.
@@ -197,7 +308,7 @@ class SleepQualityScorer:
         else:
             return "Very Poor"
     
-    def get_recommendations(self, component_scores: Dict[str, float]) -> list:
+    def get_recommendations(self, component_scores: Dict[str, float]) -> Tuple[str, ...]:
         """
         Generate recommendations based on component scores.
         
@@ -205,8 +316,13 @@ class SleepQualityScorer:
             component_scores: Dictionary of component scores
             
         Returns:
-            List of recommendation strings
+            Tuple of recommendation strings
         """
+        # Common case: every component is above its threshold
+        if (component_scores['duration'] >= 70 and component_scores['events'] >= 80 and
+                component_scores['sleep_rating'] >= 70 and component_scores['environment'] >= 70):
+            return ()
+        
         recommendations = []
         
         # Duration recommendations
@@ -231,7 +347,7 @@ class SleepQualityScorer:
         if component_scores['environment'] < 70:
             recommendations.append("Optimize sleep environment (temperature, noise, comfort)")
         
-        return recommendations
+        return tuple(recommendations)
 
 
 def main():
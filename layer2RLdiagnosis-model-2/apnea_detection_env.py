@@ -1,11 +1,172 @@
+import os
+import hashlib
+from pathlib import Path
 import numpy as np
 import gymnasium as gym
 from gymnasium import spaces
 import torch
+import torch.nn as nn
 import torch.nn.functional as F
+import torchaudio
 from typing import Dict, List, Tuple, Optional
 import librosa
 import soundfile as sf
+from scipy.signal import windows
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to plain Python
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+
+@njit(cache=True, fastmath=True)
+def ece_reward(correctness, confidence):
+    """ECE-inspired reward, correctness - (confidence - correctness)^2, for scalars or arrays"""
+    return correctness - (confidence - correctness) ** 2
+
+
+@njit(cache=True, fastmath=True)
+def _step_kernel(action, idx, labels, confidence,
+                 diag_idx, diag_labels, diag_conf, diag_reward, diag_n):
+    """Numeric body of ApneaDetectionEnv.step; returns (reward, done, next_idx, diag_n)"""
+    reward = 0.0
+    done = False
+    
+    if action == 0:  # WAIT
+        idx += 1
+    elif action == 1:  # DIAGNOSE
+        # Reward using ECE-inspired formula
+        reward = ece_reward(float(labels[idx]), confidence)
+        
+        # Record diagnosis
+        diag_idx[diag_n] = idx
+        diag_labels[diag_n] = labels[idx]
+        diag_conf[diag_n] = confidence
+        diag_reward[diag_n] = reward
+        diag_n += 1
+        idx += 1
+    elif action == 2:  # ESCALATE
+        reward = -0.1  # Small penalty for escalation
+        done = True
+    
+    # Episode ends once every segment has been consumed
+    if idx >= len(labels):
+        done = True
+    
+    return reward, done, idx, diag_n
+
+
+@njit(cache=True, fastmath=True)
+def _replay_kernel(actions, confidence, labels, rewards,
+                   diag_idx, diag_labels, diag_conf, diag_reward):
+    """Step a whole episode of per-step actions at one confidence; returns (n_steps, next_idx, diag_n)"""
+    idx = 0
+    diag_n = 0
+    n = 0
+    done = False
+    while not done and n < len(actions):
+        reward, done, idx, diag_n = _step_kernel(
+            actions[n], idx, labels, confidence,
+            diag_idx, diag_labels, diag_conf, diag_reward, diag_n
+        )
+        rewards[n] = reward
+        n += 1
+    return n, idx, diag_n
+
+
+@njit(cache=True, fastmath=True)
+def _power_to_db_norm(mel_spec, out, amin=1e-10, top_db=80.0):
+    """Fused librosa.power_to_db(ref=np.max, top_db) and z-score of one mel power matrix, into out"""
+    n_mels, n_frames = mel_spec.shape
+    log_peak = 10.0 * np.log10(max(mel_spec.max(), amin))
+    
+    # Pass 1: dB relative to the peak (clipped at -top_db) plus running moments
+    total = 0.0
+    total_sq = 0.0
+    for i in range(n_mels):
+        for j in range(n_frames):
+            db = 10.0 * np.log10(max(mel_spec[i, j], amin)) - log_peak
+            if db < -top_db:
+                db = -top_db
+            out[i, j] = db
+            total += db
+            total_sq += db * db
+    
+    # Pass 2: normalize in place
+    n = n_mels * n_frames
+    mean = total / n
+    std = np.sqrt(max(total_sq / n - mean * mean, 0.0))
+    scale = 1.0 / (std + 1e-8)
+    for i in range(n_mels):
+        for j in range(n_frames):
+            out[i, j] = (out[i, j] - mean) * scale
+    
+    return out
+
+
+# Compile once at import so the first episode doesn't pay the JIT cost
+_step_kernel(1, 0, np.zeros(1, dtype=np.int8), 0.7,
+             np.empty(1, dtype=np.int32), np.empty(1, dtype=np.int8),
+             np.empty(1, dtype=np.float32), np.empty(1, dtype=np.float32), 0)
+_replay_kernel(np.ones(1, dtype=np.int64), 0.7, np.zeros(1, dtype=np.int8),
+               np.empty(1, dtype=np.float32), np.empty(1, dtype=np.int32), np.empty(1, dtype=np.int8),
+               np.empty(1, dtype=np.float32), np.empty(1, dtype=np.float32))
+_power_to_db_norm(np.ones((2, 2), dtype=np.float32), np.empty((2, 2), dtype=np.float32))
+
+
+# On-disk cache of extracted features, keyed by feature parameters and cache id
+FEATURE_CACHE_DIR = Path('~/.cache/sleeppilot/features').expanduser()
+
+
+class LogMelFrontend(nn.Module):
+    """
+    Batched torchaudio equivalent of the librosa mel pipeline used by the env:
+    melspectrogram (n_fft=2048, hop=512, 128 slaney mels) -> power_to_db (top_db=80)
+    -> per-segment z-score. Input (N, T) waveforms, output (N, 128, n_frames).
+    """
+    
+    def __init__(self, sample_rate: int = 16000):
+        super().__init__()
+        self.melspec = torchaudio.transforms.MelSpectrogram(
+            sample_rate=sample_rate,
+            n_fft=2048,
+            hop_length=512,
+            n_mels=128,
+            norm='slaney',
+            mel_scale='slaney',
+            pad_mode='constant'
+        )
+        self.to_db = torchaudio.transforms.AmplitudeToDB(stype='power', top_db=80.0)
+    
+    def forward(self, wav: torch.Tensor) -> torch.Tensor:
+        # (N, 1, mels, frames) so top_db is applied per segment, not across the batch
+        mel_db = self.to_db(self.melspec(wav).unsqueeze(1)).squeeze(1)
+        mean = mel_db.mean(dim=(-1, -2), keepdim=True)
+        std = mel_db.std(dim=(-1, -2), keepdim=True, unbiased=False)
+        return (mel_db - mean) / (std + 1e-8)
+
+
+# Compiled mel frontends, one per (sample rate, device), shared by every env
+_COMPILED_FRONTEND = {}
+
+
+def _get_compiled_frontend(sample_rate: int, device: torch.device) -> nn.Module:
+    """Compiled LogMelFrontend, built (and autotuned on first call) once per sample rate and device.
+    
+    Shapes are fixed (batch_size x segment length), so the graph is shape-specialized; sharing
+    one module keeps later envs (e.g. one per patient) on the already-compiled graph.
+    """
+    key = (sample_rate, str(device))
+    if key not in _COMPILED_FRONTEND:
+        _COMPILED_FRONTEND[key] = torch.compile(
+            LogMelFrontend(sample_rate).to(device), mode='max-autotune', dynamic=False
+        )
+    return _COMPILED_FRONTEND[key]
 
 
 class ApneaDetectionEnv(gym.Env):
@@ -21,19 +182,31 @@ class ApneaDetectionEnv(gym.Env):
     """
     
     def __init__(self, audio_segments: List[np.ndarray], labels: List[int], 
-                 segment_duration: float = 10.0, sample_rate: int = 16000):
+                 segment_duration: float = 10.0, sample_rate: int = 16000,
+                 raw_audio: bool = False, feature_cache_id: Optional[str] = None,
+                 features: Optional[np.ndarray] = None):
         super().__init__()
         
         self.audio_segments = audio_segments
         self.labels = labels
+        self._labels = np.asarray(labels, dtype=np.int8)
         self.segment_duration = segment_duration
         self.sample_rate = sample_rate
+        # Serve raw waveforms and let the policy compute mels on its own device
+        self.raw_audio = raw_audio
         
         # Environment state
         self.current_segment_idx = 0
-        self.diagnosed_segments = []
         self.escalated = False
         
+        # Diagnoses recorded as parallel arrays (at most one per segment) plus a cursor
+        n_segments = len(audio_segments)
+        self._diag_idx = np.empty(n_segments, dtype=np.int32)
+        self._diag_labels = np.empty(n_segments, dtype=np.int8)
+        self._diag_conf = np.empty(n_segments, dtype=np.float32)
+        self._diag_reward = np.empty(n_segments, dtype=np.float32)
+        self._diag_n = 0
+        
         # Action and observation spaces
         self.action_space = spaces.Discrete(3)  # WAIT, DIAGNOSE, ESCALATE
         
@@ -41,22 +214,100 @@ class ApneaDetectionEnv(gym.Env):
         # Using 128 mel bands and variable time frames based on 10-second segments
         n_mels = 128
         n_frames = int(segment_duration * sample_rate / 512) + 1  # Approximate frame count
+        # Mel observations carry their conv channel axis so the policy sees a fixed rank
+        obs_shape = (int(segment_duration * sample_rate),) if raw_audio else (1, n_mels, n_frames)
+        # Mel observations are served as float16 straight from the stored features
+        obs_dtype = np.float32 if raw_audio else np.float16
         self.observation_space = spaces.Box(
             low=-np.inf, high=np.inf, 
-            shape=(n_mels, n_frames), 
-            dtype=np.float32
+            shape=obs_shape, 
+            dtype=obs_dtype
         )
         
-        # Precompute features for all segments
-        self.features = self._extract_features()
+        # Shared, read-only terminal observation
+        self._zero_obs = np.zeros(obs_shape, dtype=obs_dtype)
+        self._zero_obs.setflags(write=False)
+        
+        if raw_audio:
+            self.features = self._extract_waveforms()
+            return
+        
+        # Features precomputed by the caller (e.g. a memmap), so skip extraction entirely
+        if features is not None:
+            self.features = features[:, None]  # (N, 1, n_mels, n_frames) view
+            return
+        
+        # Batched GPU feature extraction when CUDA is available, librosa on CPU otherwise
+        self._device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self._frontend = None
+        if self._device.type == "cuda":
+            self._frontend = _get_compiled_frontend(sample_rate, self._device)
+        
+        # Mel filter bank and STFT window for the CPU path, built once instead of per segment
+        self._mel_basis = librosa.filters.mel(sr=sample_rate, n_fft=2048, n_mels=128)
+        self._window = windows.hann(2048, sym=False)
+        
+        # Precompute features for all segments (stored and served as float16),
+        # reusing a cached copy when the caller identifies the segments
+        if feature_cache_id is not None:
+            features = self._load_or_extract_features(feature_cache_id)
+        else:
+            features = self._extract_features()
+        self.features = features[:, None]  # (N, 1, n_mels, n_frames) view
+    
+    def _load_or_extract_features(self, cache_id: str) -> np.ndarray:
+        """Load features from the disk cache if fresh, otherwise extract and cache them."""
+        params = (self.sample_rate, 128, 512, 2048, self.segment_duration)
+        key = hashlib.blake2b(str(params).encode() + cache_id.encode(), digest_size=16).hexdigest()
+        cache_path = FEATURE_CACHE_DIR / f"{key}.npy"
+        
+        # Stale if any source file changed after the cache was written
+        source_files = getattr(self.audio_segments, 'source_files', ())
+        source_mtime = max((os.path.getmtime(f) for f in source_files), default=0.0)
+        if cache_path.exists() and cache_path.stat().st_mtime >= source_mtime:
+            return np.load(cache_path, mmap_mode='r')
         
-    def _extract_features(self) -> List[np.ndarray]:
-        """Extract mel-spectrogram features from audio segments."""
-        features = []
+        features = self._extract_features()
+        FEATURE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        np.save(cache_path, features)
+        return features
         
-        for segment in self.audio_segments:
+    def _extract_waveforms(self) -> np.ndarray:
+        """Zero-padded / truncated float32 waveforms, one row per segment."""
+        target_length = int(self.segment_duration * self.sample_rate)
+        waveforms = np.zeros((len(self.audio_segments), target_length), dtype=np.float32)
+        for i, segment in enumerate(self.audio_segments):
+            length = min(len(segment), target_length)
+            waveforms[i, :length] = segment[:length]
+        return waveforms
+    
+    def _extract_features_batched(self, out: np.ndarray, target_length: int, batch_size: int = 256) -> None:
+        """Fill out with mel-spectrogram features for all segments, one GPU pass per chunk."""
+        # One pinned staging slab reused for every chunk instead of a padded copy per segment
+        staging = torch.zeros((batch_size, target_length), dtype=torch.float32, pin_memory=True)
+        buf = staging.numpy()
+        
+        for start in range(0, len(self.audio_segments), batch_size):
+            chunk = self.audio_segments[start:start + batch_size]
+            for i, segment in enumerate(chunk):
+                length = min(len(segment), target_length)
+                buf[i, :length] = segment[:length]
+                buf[i, length:] = 0.0
+            # Always run the full slab so the compiled graph sees a single shape
+            buf[len(chunk):] = 0.0
+            with torch.no_grad():
+                batch = staging.to(self._device, non_blocking=True)
+                mel = self._frontend(batch)[:len(chunk)]
+            # .cpu() synchronizes, so the staging slab is free to refill afterwards
+            out[start:start + len(chunk)] = mel.half().cpu().numpy()
+    
+    @staticmethod
+    def _extract_one(segment: np.ndarray, target_length: int,
+                     mel_basis: np.ndarray, window: np.ndarray) -> np.ndarray:
+        """Extract the normalized log-mel spectrogram of a single segment."""
+        # One BLAS/FFT thread per worker so parallel segments don't oversubscribe cores
+        with threadpool_limits(limits=1):
             # Ensure segment is the right length
-            target_length = int(self.segment_duration * self.sample_rate)
             if len(segment) < target_length:
                 # Pad with zeros if too short
                 segment = np.pad(segment, (0, target_length - len(segment)))
@@ -64,23 +315,33 @@ class ApneaDetectionEnv(gym.Env):
                 # Truncate if too long
                 segment = segment[:target_length]
             
-            # Extract mel-spectrogram
-            mel_spec = librosa.feature.melspectrogram(
-                y=segment, 
-                sr=self.sample_rate,
-                n_mels=128,
-                hop_length=512,
-                n_fft=2048
-            )
-            
-            # Convert to log scale
-            mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
-            
-            # Normalize
-            mel_spec_db = (mel_spec_db - mel_spec_db.mean()) / (mel_spec_db.std() + 1e-8)
-            
-            features.append(mel_spec_db.astype(np.float32))
+            # Extract mel-spectrogram with the cached filter bank and window
+            D = librosa.stft(segment, n_fft=2048, hop_length=512, window=window, center=True)
+            power = D.real * D.real + D.imag * D.imag
+            mel_spec = (mel_basis @ power).astype(np.float32, copy=False)
             
+            # Log scale and normalize in one fused pass
+            return _power_to_db_norm(mel_spec, np.empty_like(mel_spec))
+    
+    def _extract_features(self) -> np.ndarray:
+        """Extract mel-spectrogram features from audio segments into one (N, 128, n_frames) float16 array."""
+        target_length = int(self.segment_duration * self.sample_rate)
+        n_frames = 1 + target_length // 512
+        # z-scored log-mels are well within float16 range and precision needs
+        features = np.empty((len(self.audio_segments), 128, n_frames), dtype=np.float16)
+        
+        if self._frontend is not None:
+            self._extract_features_batched(features, target_length)
+            return features
+        
+        # Segments are independent, so fan them out across all cores
+        results = Parallel(n_jobs=os.cpu_count(), batch_size=32, return_as="generator")(
+            delayed(self._extract_one)(segment, target_length, self._mel_basis, self._window)
+            for segment in self.audio_segments
+        )
+        for i, mel_spec_db in enumerate(results):
+            features[i] = mel_spec_db
+        
         return features
     
     def reset(self, seed: Optional[int] = None) -> Tuple[np.ndarray, Dict]:
@@ -88,7 +349,7 @@ class ApneaDetectionEnv(gym.Env):
         super().reset(seed=seed)
         
         self.current_segment_idx = 0
-        self.diagnosed_segments = []
+        self._diag_n = 0
         self.escalated = False
         
         observation = self.features[0]
@@ -103,75 +364,64 @@ class ApneaDetectionEnv(gym.Env):
     
     def step(self, action: int) -> Tuple[np.ndarray, float, bool, bool, Dict]:
         """Execute one step in the environment."""
-        done = False
-        reward = 0.0
-        info = {}
+        # Simulate confidence from agent (this will be replaced by actual model prediction)
+        # For now, use a placeholder confidence
+        confidence = 0.7  # This will come from the RL agent's policy
         
-        if action == 0:  # WAIT
-            reward = 0.0
-            self.current_segment_idx += 1
-            
-        elif action == 1:  # DIAGNOSE
-            # Get current segment info
-            current_label = self.labels[self.current_segment_idx]
-            
-            # Simulate confidence from agent (this will be replaced by actual model prediction)
-            # For now, use a placeholder confidence
-            confidence = 0.7  # This will come from the RL agent's policy
-            
-            # Calculate reward using ECE-inspired formula
-            correctness = float(current_label)
-            reward = correctness - (confidence - correctness) ** 2
-            
-            # Record diagnosis
-            self.diagnosed_segments.append({
-                'segment_idx': self.current_segment_idx,
-                'label': current_label,
-                'confidence': confidence,
-                'reward': reward
-            })
-            
-            self.current_segment_idx += 1
-            
-        elif action == 2:  # ESCALATE
-            reward = -0.1  # Small penalty for escalation
+        reward, done, self.current_segment_idx, self._diag_n = _step_kernel(
+            int(action), self.current_segment_idx, self._labels, confidence,
+            self._diag_idx, self._diag_labels, self._diag_conf, self._diag_reward, self._diag_n
+        )
+        if action == 2:
             self.escalated = True
-            done = True
-        
-        # Check if episode is done
-        if self.current_segment_idx >= len(self.audio_segments):
-            done = True
         
         # Get next observation
         if not done:
             observation = self.features[self.current_segment_idx]
         else:
-            observation = np.zeros_like(self.features[0])
+            observation = self._zero_obs
         
         # Update info
         info = {
             'current_segment': self.current_segment_idx,
             'total_segments': len(self.audio_segments),
-            'diagnosed_count': len(self.diagnosed_segments),
-            'escalated': self.escalated,
-            'diagnosed_segments': self.diagnosed_segments
+            'diagnosed_count': self._diag_n,
+            'escalated': self.escalated
         }
         
-        return observation, reward, done, False, info
+        return observation, float(reward), bool(done), False, info
+    
+    def replay(self, actions: np.ndarray) -> np.ndarray:
+        """Run a whole episode from per-step actions (e.g. batched policy output), as step() would.
+        
+        Step i acts on segment i, as every non-terminal step advances one segment. Returns the
+        rewards of the steps taken; results are then available from get_episode_results.
+        """
+        self.reset()
+        actions = np.asarray(actions, dtype=np.int64)
+        rewards = np.empty(len(actions), dtype=np.float32)
+        n, self.current_segment_idx, self._diag_n = _replay_kernel(
+            actions, 0.7, self._labels, rewards,  # step()'s placeholder confidence
+            self._diag_idx, self._diag_labels, self._diag_conf, self._diag_reward
+        )
+        self.escalated = bool(n) and actions[n - 1] == 2
+        return rewards[:n]
     
     def get_episode_results(self) -> Dict:
         """Get results from the completed episode."""
-        if not self.diagnosed_segments:
+        n = self._diag_n
+        if n == 0:
             return {}
         
         # Calculate metrics
-        labels = [seg['label'] for seg in self.diagnosed_segments]
-        confidences = [seg['confidence'] for seg in self.diagnosed_segments]
-        rewards = [seg['reward'] for seg in self.diagnosed_segments]
+        segment_idx = self._diag_idx[:n]
+        labels = self._diag_labels[:n]
+        confidences = self._diag_conf[:n]
+        rewards = self._diag_reward[:n]
         
         # Calculate severity (number of apnea events)
-        apnea_count = sum(labels)
-        severity = apnea_count / len(self.diagnosed_segments) if self.diagnosed_segments else 0
+        apnea_count = int(labels.sum())
+        severity = apnea_count / n
         
         # Calculate median confidence
         median_confidence = np.median(confidences)
@@ -180,35 +430,35 @@ class ApneaDetectionEnv(gym.Env):
         ece = self._calculate_ece(labels, confidences)
         
         return {
-            'total_segments': len(self.diagnosed_segments),
+            'total_segments': n,
             'apnea_count': apnea_count,
-            'normal_count': len(self.diagnosed_segments) - apnea_count,
+            'normal_count': n - apnea_count,
             'severity': severity,
             'median_confidence': median_confidence,
             'ece': ece,
-            'mean_reward': np.mean(rewards),
-            'diagnosed_segments': self.diagnosed_segments
+            'mean_reward': rewards.mean(),
+            'diagnosed_segments': [
+                {'segment_idx': int(i), 'label': int(l), 'confidence': float(c), 'reward': float(r)}
+                for i, l, c, r in zip(segment_idx, labels, confidences, rewards)
+            ]
         }
     
     def _calculate_ece(self, labels: List[int], confidences: List[float], 
                       n_bins: int = 10) -> float:
         """Calculate Expected Calibration Error."""
+        labels = np.asarray(labels, dtype=np.float64)
+        confidences = np.asarray(confidences, dtype=np.float64)
         bin_boundaries = np.linspace(0, 1, n_bins + 1)
-        bin_lowers = bin_boundaries[:-1]
-        bin_uppers = bin_boundaries[1:]
-        
-        ece = 0.0
-        for bin_lower, bin_upper in zip(bin_lowers, bin_uppers):
-            # Find predictions in this bin
-            in_bin = np.logical_and(confidences > bin_lower, confidences <= bin_upper)
-            bin_size = np.sum(in_bin)
-            
-            if bin_size > 0:
-                bin_acc = np.sum(np.array(labels)[in_bin]) / bin_size
-                bin_conf = np.mean(np.array(confidences)[in_bin])
-                ece += bin_size * np.abs(bin_acc - bin_conf)
         
-        return ece / len(labels)
+        # Bin index per prediction for (lower, upper] bins, then per-bin sums in one pass each
+        idx = np.digitize(confidences, bin_boundaries, right=True) - 1
+        valid = (idx >= 0) & (idx < n_bins)
+        idx = idx[valid]
+        bin_acc_sum = np.bincount(idx, weights=labels[valid], minlength=n_bins)
+        bin_conf_sum = np.bincount(idx, weights=confidences[valid], minlength=n_bins)
+        
+        # bin_size * |bin_acc - bin_conf| == |bin_acc_sum - bin_conf_sum|; empty bins add 0
+        return float(np.abs(bin_acc_sum - bin_conf_sum).sum()) / len(labels)
 
 
 class ApneaDetectionEnvWrapper:
@@ -225,10 +475,14 @@ class ApneaDetectionEnvWrapper:
             raise ValueError(f"Patient {patient_id} not found in data")
         
         patient_info = self.patient_data[patient_id]
+        segments = patient_info['segments']
+        # Cache features per patient and segment order so switching patients doesn't re-extract
+        fingerprint = getattr(segments, 'fingerprint', None)
         self.current_patient = patient_id
         self.current_env = ApneaDetectionEnv(
-            audio_segments=patient_info['segments'],
-            labels=patient_info['labels']
+            audio_segments=segments,
+            labels=patient_info['labels'],
+            feature_cache_id=f"{patient_id}-{fingerprint()}" if fingerprint is not None else None
         )
         
         return self.current_env
@@ -1,28 +1,147 @@
 import numpy as np
 import os
-import glob
+import hashlib
+import warnings
+import pickle
+from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 import kagglehub
 import librosa
 import soundfile as sf
+import soxr
+from scipy.signal import get_window
 from sklearn.model_selection import train_test_split
-import matplotlib.pyplot as plt
-import seaborn as sns
 from tqdm import tqdm
+import threading
+from queue import Queue
+import torch
+import torchaudio
+
+from apnea_detection_env import LogMelFrontend, _power_to_db_norm
+
+
+# Process-wide caches so every AudioPreprocessor reuses the same filter banks, windows and frontends
+_MEL_BASIS: Dict[tuple, np.ndarray] = {}
+_WINDOW: Dict[tuple, np.ndarray] = {}
+_FRONTEND: Dict[tuple, LogMelFrontend] = {}
+
+DATASET_CACHE_DIR = Path('~/.cache/sleeppilot/dataset').expanduser()
+
+
+def _get_mel_basis(sr: int, n_fft: int = 2048, n_mels: int = 128, fmin: float = 0.0,
+                   fmax: Optional[float] = None, dtype=np.float32) -> np.ndarray:
+    """Mel filter bank, built once per parameter set."""
+    key = (sr, n_fft, n_mels, fmin, fmax, np.dtype(dtype).str)
+    if key not in _MEL_BASIS:
+        _MEL_BASIS[key] = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels,
+                                              fmin=fmin, fmax=fmax, dtype=dtype)
+    return _MEL_BASIS[key]
+
+
+def _get_window(win_length: int = 2048, dtype=np.float32) -> np.ndarray:
+    """Periodic Hann window, built once per length and dtype."""
+    key = (win_length, np.dtype(dtype).str)
+    if key not in _WINDOW:
+        _WINDOW[key] = get_window('hann', win_length).astype(dtype)
+    return _WINDOW[key]
+
+
+def _get_frontend(sr: int, device: torch.device) -> LogMelFrontend:
+    """Batched torchaudio mel frontend, built once per sample rate and device."""
+    key = (sr, str(device))
+    if key not in _FRONTEND:
+        _FRONTEND[key] = LogMelFrontend(sr).to(device)
+    return _FRONTEND[key]
+
+
+class PatientSegments:
+    """Lazy, shuffled view over a patient's memory-mapped apnea and normal segment files."""
+    
+    def __init__(self, ap_segments: np.ndarray, nap_segments: np.ndarray, order: np.ndarray):
+        self.ap_segments = ap_segments
+        self.nap_segments = nap_segments
+        self.order = order
+        self.source_files = tuple(
+            a.filename for a in (ap_segments, nap_segments) if getattr(a, 'filename', None)
+        )
+    
+    def __getstate__(self) -> Dict:
+        # Ship file paths instead of the mapped audio so worker processes reopen the files lazily
+        if len(self.source_files) == 2:
+            return {'source_files': self.source_files, 'order': self.order}
+        return self.__dict__.copy()
+    
+    def __setstate__(self, state: Dict) -> None:
+        if 'ap_segments' not in state:
+            ap_path, nap_path = state['source_files']
+            state = dict(state, ap_segments=np.load(ap_path, mmap_mode='r'),
+                         nap_segments=np.load(nap_path, mmap_mode='r'))
+        self.__dict__.update(state)
+    
+    def fingerprint(self) -> str:
+        """Stable id of the source files and segment order, for feature caching."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update('|'.join(str(f) for f in self.source_files).encode())
+        h.update(np.ascontiguousarray(self.order).tobytes())
+        return h.hexdigest()
+    
+    def __len__(self) -> int:
+        return len(self.order)
+    
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        
+        j = self.order[idx]
+        if j < len(self.ap_segments):
+            return self.ap_segments[j]
+        return self.nap_segments[j - len(self.ap_segments)]
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ConcatSegments:
+    """Lazy view over several patients' segment sequences, indexed as one."""
+    
+    def __init__(self, parts: List):
+        self.parts = parts
+        self.offsets = np.cumsum([0] + [len(part) for part in parts])
+    
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+    
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        
+        if idx < 0:
+            idx += len(self)
+        part = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        return self.parts[part][idx - self.offsets[part]]
+    
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
 
 
 class ApneaDataLoader:
     """Data loader for the PSG-Audio Apnea dataset."""
     
-    def __init__(self, data_dir: Optional[str] = None, sample_rate: int = 16000):
+    def __init__(self, data_dir: Optional[str] = None, sample_rate: int = 16000, verbose: bool = True,
+                 seed: int = 42):
         self.sample_rate = sample_rate
         self.data_dir = data_dir
+        self.verbose = verbose
+        self.seed = seed
         
         if data_dir is None:
             # Download dataset if not provided
             self.data_dir = self._download_dataset()
         
         self.patient_data = {}
+        self._source_files = []
         self._load_data()
     
     def _download_dataset(self) -> str:
@@ -39,106 +158,108 @@ class ApneaDataLoader:
     
     def _load_data(self) -> None:
         """Load all patient data from the dataset with progress tracking."""
-        print("🔄 Loading patient data...")
-        
-        # The actual .npy files are in the PSG-AUDIO subdirectory
-        # Look for the PSG-AUDIO directory within the downloaded dataset
-        psg_audio_dir = None
-        
-        # Search for PSG-AUDIO directory
-        print("🔍 Searching for PSG-AUDIO directory...")
-        for root, dirs, files in os.walk(self.data_dir):
-            if 'PSG-AUDIO' in dirs:
-                psg_audio_dir = os.path.join(root, 'PSG-AUDIO')
-                break
-        
-        if psg_audio_dir is None:
-            # Fallback: try to find it in common locations
-            possible_paths = [
-                os.path.join(self.data_dir, 'PSG-AUDIO'),
-                os.path.join(self.data_dir, 'versions', '3', 'PSG-AUDIO'),
-                os.path.join(self.data_dir, 'datasets', 'bryandarquea', 'psg-audio-apnea-audios', 'versions', '3', 'PSG-AUDIO')
-            ]
-            
-            for path in possible_paths:
-                if os.path.exists(path):
-                    psg_audio_dir = path
-                    break
-        
-        if psg_audio_dir is None:
-            raise ValueError(f"Could not find PSG-AUDIO directory in {self.data_dir}")
-        
-        print(f"✅ Found PSG-AUDIO directory at: {psg_audio_dir}")
-        
-        # Find all apnea and normal files in the PSG-AUDIO directory
-        ap_files = glob.glob(os.path.join(psg_audio_dir, "*_ap.npy"))
-        nap_files = glob.glob(os.path.join(psg_audio_dir, "*_nap.npy"))
-        
-        print(f"📁 Found {len(ap_files)} apnea files and {len(nap_files)} normal files")
-        
-        if len(ap_files) == 0 and len(nap_files) == 0:
-            # Try searching recursively
-            print("🔍 No files found in root, searching recursively...")
-            ap_files = []
-            nap_files = []
-            for root, dirs, files in os.walk(psg_audio_dir):
-                for file in files:
-                    if file.endswith('_ap.npy'):
-                        ap_files.append(os.path.join(root, file))
-                    elif file.endswith('_nap.npy'):
-                        nap_files.append(os.path.join(root, file))
-            
-            print(f"✅ Recursive search found {len(ap_files)} apnea files and {len(nap_files)} normal files")
+        self._log("🔄 Loading patient data...")
         
-        # Group files by patient ID
-        print("📋 Grouping files by patient ID...")
+        # Single pass over the dataset tree, classifying files by suffix
+        self._log("🔍 Searching for apnea and normal segment files...")
         patient_files = {}
-        for file_path in ap_files + nap_files:
-            filename = os.path.basename(file_path)
-            patient_id = filename.split('_')[0]
-            
-            if patient_id not in patient_files:
-                patient_files[patient_id] = {'ap': None, 'nap': None}
+        ap_count = nap_count = 0
+        for path in Path(self.data_dir).rglob('*ap.npy'):
+            name = path.name
+            if name.endswith('_ap.npy'):
+                key = 'ap'
+                ap_count += 1
+            elif name.endswith('_nap.npy'):
+                key = 'nap'
+                nap_count += 1
+            else:
+                continue
             
-            if '_ap.npy' in filename:
-                patient_files[patient_id]['ap'] = file_path
-            elif '_nap.npy' in filename:
-                patient_files[patient_id]['nap'] = file_path
-        
-        # Load data for each patient with progress bar
-        print(f"📊 Loading data for {len(patient_files)} patients...")
-        for patient_id, files in tqdm(patient_files.items(), desc="Loading patient data", unit="patient"):
-            if files['ap'] is not None and files['nap'] is not None:
-                try:
-                    # Load apnea segments
-                    ap_segments = np.load(files['ap'])
-                    ap_labels = np.ones(len(ap_segments))  # 1 for apnea
-                    
-                    # Load normal segments
-                    nap_segments = np.load(files['nap'])
-                    nap_labels = np.zeros(len(nap_segments))  # 0 for normal
-                    
-                    # Combine segments and labels
-                    all_segments = np.concatenate([ap_segments, nap_segments])
-                    all_labels = np.concatenate([ap_labels, nap_labels])
-                    
-                    # Shuffle data
-                    indices = np.random.permutation(len(all_segments))
-                    all_segments = all_segments[indices]
-                    all_labels = all_labels[indices]
-                    
-                    self.patient_data[patient_id] = {
-                        'segments': all_segments,
-                        'labels': all_labels,
-                        'ap_count': len(ap_segments),
-                        'normal_count': len(nap_segments)
-                    }
-                    
-                except Exception as e:
-                    print(f"⚠️ Error loading data for patient {patient_id}: {e}")
-                    continue
-        
-        print(f"✅ Successfully loaded data for {len(self.patient_data)} patients")
+            patient_id = name.split('_')[0]
+            patient_files.setdefault(patient_id, {'ap': None, 'nap': None})[key] = str(path)
+        
+        if not patient_files:
+            raise ValueError(f"Could not find PSG-AUDIO segment files in {self.data_dir}")
+        
+        self._log(f"📁 Found {ap_count} apnea files and {nap_count} normal files")
+        
+        # Two-stage pipeline: a reader thread opens patient files into a bounded queue while
+        # this thread shuffles and indexes each patient as it arrives
+        self._log(f"📊 Loading data for {len(patient_files)} patients...")
+        # Sorted by patient ID: rglob's walk order depends on the filesystem
+        complete = [(pid, files) for pid, files in sorted(patient_files.items())
+                    if files['ap'] is not None and files['nap'] is not None]
+        self._source_files = [path for _, files in complete for path in (files['ap'], files['nap'])]
+        queue = Queue(maxsize=8)
+        reader = threading.Thread(target=self._read_patients, args=(complete, queue), daemon=True)
+        reader.start()
+        
+        # Patients arrive in sorted order, so one seeded generator keeps the shuffle reproducible
+        rng = np.random.default_rng(self.seed)
+        with tqdm(total=len(complete), desc="Loading patient data", unit="patient",
+                  mininterval=2.0, disable=not self.verbose) as pbar:
+            while (item := queue.get()) is not None:
+                patient_id, ap_segments, nap_segments = item
+                if ap_segments is not None:
+                    self.patient_data[patient_id] = self._index_patient(ap_segments, nap_segments, rng)
+                pbar.update()
+        reader.join()
+        
+        self._log(f"✅ Successfully loaded data for {len(self.patient_data)} patients")
+    
+    def _log(self, message: str) -> None:
+        """Print a progress message when the loader is verbose."""
+        if self.verbose:
+            print(message)
+    
+    def _read_patients(self, complete: List[Tuple[str, Dict[str, str]]], queue: Queue) -> None:
+        """Reader stage: open each patient's segment files and queue them, then a None sentinel."""
+        for patient_id, files in complete:
+            try:
+                # Memory-map segments; pages are read on first access instead of up front
+                ap_segments = np.load(files['ap'], mmap_mode='r')
+                nap_segments = np.load(files['nap'], mmap_mode='r')
+                queue.put((patient_id, ap_segments, nap_segments))
+            except Exception as e:
+                self._log(f"⚠️ Error loading data for patient {patient_id}: {e}")
+                queue.put((patient_id, None, None))
+        queue.put(None)
+    
+    @staticmethod
+    def _index_patient(ap_segments: np.ndarray, nap_segments: np.ndarray,
+                       rng: np.random.Generator) -> Dict:
+        """Label and shuffle one patient's apnea and normal segments."""
+        # Shuffle an index over both files instead of concatenating the audio
+        order = rng.permutation(len(ap_segments) + len(nap_segments))
+        labels = (order < len(ap_segments)).astype(np.int8)  # 1 for apnea, 0 for normal
+        
+        return {
+            'segments': PatientSegments(ap_segments, nap_segments, order),
+            'labels': labels,
+            'ap_count': len(ap_segments),
+            'normal_count': len(nap_segments)
+        }
+    
+    def source_mtime(self) -> float:
+        """Newest modification time among the loaded segment files."""
+        return max((os.path.getmtime(f) for f in self._source_files), default=0.0)
+    
+    def _load_or_compute(self, name: str, params: tuple, compute):
+        """Return a pickled result from the dataset cache if fresh, otherwise compute and cache it."""
+        key = hashlib.blake2b(str((os.path.abspath(self.data_dir), self.seed) + params).encode(),
+                              digest_size=16).hexdigest()
+        cache_path = DATASET_CACHE_DIR / f"{name}-{key}.pkl"
+        
+        # Stale if any segment file changed after the cache was written
+        if cache_path.exists() and cache_path.stat().st_mtime >= self.source_mtime():
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+        
+        result = compute()
+        DATASET_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return result
     
     def get_patient_data(self, patient_id: str) -> Optional[Dict]:
         """Get data for a specific patient."""
@@ -149,7 +270,7 @@ class ApneaDataLoader:
         return list(self.patient_data.keys())
     
     def get_patient_statistics(self) -> Dict:
-        """Get statistics about the loaded dataset."""
+        """Get statistics about the loaded dataset, cached on disk alongside the split."""
         if not self.patient_data:
             return {
                 'total_patients': 0,
@@ -159,6 +280,10 @@ class ApneaDataLoader:
                 'patient_details': {}
             }
         
+        return self._load_or_compute('stats', tuple(sorted(self.patient_data)), self._compute_patient_statistics)
+    
+    def _compute_patient_statistics(self) -> Dict:
+        """Aggregate segment counts over all loaded patients."""
         stats = {
             'total_patients': len(self.patient_data),
             'total_segments': 0,
@@ -198,6 +323,20 @@ class ApneaDataLoader:
             print("⚠️ Warning: No patients available for splitting")
             return [], [], []
         
+        params = (tuple(sorted(patient_ids)), train_ratio, val_ratio, test_ratio, random_state)
+        train_patients, val_patients, test_patients = self._load_or_compute(
+            'split', params,
+            lambda: self._split_patient_ids(patient_ids, train_ratio, val_ratio, test_ratio, random_state)
+        )
+        
+        print(f"📊 Split: {len(train_patients)} train, {len(val_patients)} validation, {len(test_patients)} test patients")
+        
+        return train_patients, val_patients, test_patients
+    
+    @staticmethod
+    def _split_patient_ids(patient_ids: List[str], train_ratio: float, val_ratio: float,
+                           test_ratio: float, random_state: int) -> Tuple[List[str], List[str], List[str]]:
+        """Two-stage train/(val+test) then val/test split of the patient IDs."""
         # First split: train vs (val + test)
         train_patients, temp_patients = train_test_split(
             patient_ids, 
@@ -213,23 +352,19 @@ class ApneaDataLoader:
             random_state=random_state
         )
         
-        print(f"📊 Split: {len(train_patients)} train, {len(val_patients)} validation, {len(test_patients)} test patients")
-        
         return train_patients, val_patients, test_patients
     
-    def create_environment_data(self, patient_ids: List[str]) -> List[Tuple[np.ndarray, int]]:
-        """Create data suitable for the RL environment with progress tracking."""
-        environment_data = []
+    def create_environment_data(self, patient_ids: List[str]) -> Tuple['ConcatSegments', np.ndarray]:
+        """Create data suitable for the RL environment: a lazy segment view and int8 labels."""
+        present = [pid for pid in patient_ids if pid in self.patient_data]
+        print(f"🏗️ Creating environment data for {len(present)} patients...")
         
-        print(f"🏗️ Creating environment data for {len(patient_ids)} patients...")
-        for patient_id in tqdm(patient_ids, desc="Processing patients", unit="patient"):
-            if patient_id in self.patient_data:
-                data = self.patient_data[patient_id]
-                for segment, label in zip(data['segments'], data['labels']):
-                    environment_data.append((segment, int(label)))
+        segments = ConcatSegments([self.patient_data[pid]['segments'] for pid in present])
+        labels = (np.concatenate([self.patient_data[pid]['labels'] for pid in present]).astype(np.int8, copy=False)
+                  if present else np.empty(0, dtype=np.int8))
         
-        print(f"✅ Created {len(environment_data)} environment data points")
-        return environment_data
+        print(f"✅ Created {len(labels)} environment data points")
+        return segments, labels
     
     def visualize_patient_distribution(self, save_path: Optional[str] = None) -> None:
         """Visualize the distribution of segments across patients."""
@@ -250,6 +385,7 @@ class ApneaDataLoader:
             return
         
         print("📊 Generating patient distribution visualization...")
+        import matplotlib.pyplot as plt
         fig, axes = plt.subplots(2, 2, figsize=(15, 12))
         
         # Patient segment counts
@@ -329,12 +465,31 @@ class AudioPreprocessor:
         self.target_sr = target_sr
         self.segment_duration = segment_duration
         self.segment_length = int(target_sr * segment_duration)
+        self._device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # Batched torchaudio mel frontend (window and filter bank live in its buffers on the device)
+        self._frontend = _get_frontend(target_sr, self._device) if self._device.type == "cuda" else None
+        self._resampler_cache = {}
+        
+        # Shared mel filter bank and STFT window for the CPU feature paths
+        self._mel_basis = _get_mel_basis(target_sr)
+        self._window = _get_window()
+    
+    def _resample(self, audio: np.ndarray, sr: int) -> np.ndarray:
+        """Resample audio to the target rate if necessary."""
+        if sr == self.target_sr:
+            return audio
+        
+        # Polyphase kernel is built once per (orig_sr, target_sr) pair
+        key = (sr, self.target_sr)
+        if key not in self._resampler_cache:
+            self._resampler_cache[key] = torchaudio.transforms.Resample(sr, self.target_sr).to(self._device)
+        with torch.no_grad():
+            wav = torch.as_tensor(audio, dtype=torch.float32, device=self._device)
+            return self._resampler_cache[key](wav).cpu().numpy()
     
     def preprocess_audio(self, audio: np.ndarray, sr: int) -> np.ndarray:
         """Preprocess audio for the RL environment."""
-        # Resample if necessary
-        if sr != self.target_sr:
-            audio = librosa.resample(audio, orig_sr=sr, target_sr=self.target_sr)
+        audio = self._resample(audio, sr)
         
         # Ensure correct length
         if len(audio) < self.segment_length:
@@ -346,27 +501,35 @@ class AudioPreprocessor:
         
         return audio
     
-    def segment_audio(self, audio: np.ndarray, sr: int) -> List[np.ndarray]:
-        """Segment audio into fixed-length segments with progress tracking."""
-        # Preprocess audio
-        audio = self.preprocess_audio(audio, sr)
-        
-        # Segment into fixed-length chunks
-        segments = []
-        total_segments = len(audio) // self.segment_length
-        
-        print(f"✂️ Segmenting audio into {total_segments} segments...")
-        for i in tqdm(range(0, len(audio), self.segment_length), desc="Creating segments", unit="segment"):
-            segment = audio[i:i + self.segment_length]
-            if len(segment) == self.segment_length:
-                segments.append(segment)
+    def segment_audio(self, audio: np.ndarray, sr: int, overlap: float = 0.0) -> np.ndarray:
+        """Segment audio into fixed-length segments, returned as an (n_segments, segment_length) view."""
+        # Resample only; the whole recording is segmented, not truncated to one segment
+        audio = self._resample(audio, sr)
+        if len(audio) < self.segment_length:
+            audio = np.pad(audio, (0, self.segment_length - len(audio)))
         
-        return segments
+        # Strided, zero-copy windows; hop == segment_length gives non-overlapping segments
+        # and drops the trailing partial one
+        hop = max(1, int(self.segment_length * (1.0 - overlap)))
+        return np.lib.stride_tricks.sliding_window_view(audio, self.segment_length)[::hop]
     
     def load_audio(self, audio_path: str) -> Tuple[np.ndarray, int]:
-        """Load audio file and return audio data and sample rate."""
+        """Load audio file as mono float32 at the target sample rate; returns (audio, sr)."""
         try:
-            audio, sr = librosa.load(audio_path, sr=None)
+            try:
+                audio, sr = sf.read(audio_path, dtype='float32', always_2d=False)
+            except sf.LibsndfileError:
+                # Formats libsndfile can't decode (e.g. mp3 on older builds) go through librosa,
+                # whose audioread fallback warns on every call
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    audio, sr = librosa.load(audio_path, sr=None)
+            
+            if audio.ndim > 1:
+                audio = audio.mean(axis=1)
+            if sr != self.target_sr:
+                audio = soxr.resample(audio, sr, self.target_sr, quality='HQ')
+                sr = self.target_sr
             return audio, sr
         except Exception as e:
             print(f"❌ Error loading audio file {audio_path}: {e}")
@@ -374,18 +537,17 @@ class AudioPreprocessor:
     
     def extract_features(self, audio: np.ndarray) -> np.ndarray:
         """Extract mel-spectrogram features from audio."""
+        # On GPU, run the segment through the batched torchaudio frontend
+        if self._frontend is not None and self._device.type == "cuda":
+            return self.batch_extract_features([audio])[0]
+        
         # Ensure audio is the right length
         if len(audio) != self.segment_length:
             audio = self.preprocess_audio(audio, self.target_sr)
         
-        # Extract mel-spectrogram
-        mel_spec = librosa.feature.melspectrogram(
-            y=audio,
-            sr=self.target_sr,
-            n_mels=128,
-            hop_length=512,
-            n_fft=2048
-        )
+        # Extract mel-spectrogram with the cached filter bank and window
+        D = librosa.stft(audio, n_fft=2048, hop_length=512, window=self._window, center=True)
+        mel_spec = self._mel_basis @ (D.real * D.real + D.imag * D.imag)
         
         # Convert to log scale
         mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
@@ -394,3 +556,42 @@ class AudioPreprocessor:
         mel_spec_db = (mel_spec_db - mel_spec_db.mean()) / (mel_spec_db.std() + 1e-8)
         
         return mel_spec_db.astype(np.float32)
+    
+    def batch_extract_features(self, segments: List[np.ndarray]) -> np.ndarray:
+        """Extract mel-spectrogram features for many segments in one batched pass."""
+        if isinstance(segments, np.ndarray) and segments.ndim == 2 and segments.shape[1] == self.segment_length:
+            # Already a (B, T) slab, e.g. from segment_audio
+            batch = np.ascontiguousarray(segments, dtype=np.float32)
+        else:
+            batch = np.stack([
+                s if len(s) == self.segment_length else self.preprocess_audio(s, self.target_sr)
+                for s in segments
+            ]).astype(np.float32)
+        
+        if self._frontend is None:
+            return self._batch_extract_features_cpu(batch)
+        
+        with torch.no_grad():
+            features = self._frontend(torch.from_numpy(batch).to(self._device))
+        
+        return features.cpu().numpy()
+    
+    def _batch_extract_features_cpu(self, batch: np.ndarray, chunk_size: int = 64) -> np.ndarray:
+        """NumPy batched STFT -> mel -> dB -> z-score, framing whole chunks of segments at once."""
+        n_fft, hop = 2048, 512
+        n_frames = 1 + batch.shape[1] // hop
+        features = np.empty((len(batch), 128, n_frames), dtype=np.float32)
+        
+        for start in range(0, len(batch), chunk_size):
+            # Centered frames for every segment in the chunk: (B, n_frames, n_fft)
+            padded = np.pad(batch[start:start + chunk_size], ((0, 0), (n_fft // 2, n_fft // 2)))
+            frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft, axis=-1)[:, ::hop]
+            spec = np.fft.rfft(frames * self._window, axis=-1)
+            power = spec.real * spec.real + spec.imag * spec.imag
+            
+            # One batched GEMM against the cached filter bank: (B, n_mels, n_frames)
+            mel_spec = np.ascontiguousarray(self._mel_basis @ power.transpose(0, 2, 1), dtype=np.float32)
+            for i, m in enumerate(mel_spec):
+                _power_to_db_norm(m, features[start + i])
+        
+        return features
@@ -4,25 +4,43 @@ Main script for training and evaluating the RL-based sleep apnea detection syste
 """
 
 import os
+import hashlib
 import numpy as np
 import torch
-import matplotlib.pyplot as plt
-import seaborn as sns
 from typing import Dict, List, Tuple
 import warnings
 from tqdm import tqdm
-warnings.filterwarnings('ignore')
+from joblib import Parallel, delayed
 
-# Import our custom modules
-from data_loader import ApneaDataLoader, AudioPreprocessor
-from apnea_detection_env import ApneaDetectionEnv, ApneaDetectionEnvWrapper
-from rl_agent import ApneaRLAgent, EnhancedTrainingCallback
+# Import our custom modules; librosa/torchaudio/SB3 emit deprecation noise on import
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from data_loader import ApneaDataLoader, AudioPreprocessor
+    from apnea_detection_env import ApneaDetectionEnv, ApneaDetectionEnvWrapper
+    from rl_agent import ApneaRLAgent, EnhancedTrainingCallback
 
 # Set random seeds for reproducibility
 np.random.seed(42)
 torch.manual_seed(42)
 
 
+def _write_patient_features(preprocessor: AudioPreprocessor, segments, features: np.ndarray,
+                            offset: int, chunk_size: int) -> None:
+    """Extract one patient's features chunk by chunk into rows offset.. of features."""
+    for start in range(0, len(segments), chunk_size):
+        chunk = np.stack(segments[start:start + chunk_size])
+        features[offset + start:offset + start + len(chunk)] = preprocessor.batch_extract_features(chunk)
+
+
+def _extract_patient_features(segments, out_path: str, offset: int, target_sr: int,
+                              segment_duration: float, chunk_size: int) -> None:
+    """Worker: extract one patient's features straight into its rows of the shared memmap."""
+    preprocessor = AudioPreprocessor(target_sr=target_sr, segment_duration=segment_duration)
+    features = np.load(out_path, mmap_mode='r+')
+    _write_patient_features(preprocessor, segments, features, offset, chunk_size)
+    features.flush()
+
+
 class ApneaDetectionPipeline:
     """Complete pipeline for apnea detection using RL."""
     
@@ -33,6 +51,10 @@ class ApneaDetectionPipeline:
         self.preprocessor = None
         self.agent = None
         
+        # Precomputed per-segment features and each patient's rows in them
+        self.features = None
+        self.feature_slices = {}
+        
         # Create model directory
         os.makedirs(model_save_dir, exist_ok=True)
         
@@ -66,9 +88,79 @@ class ApneaDetectionPipeline:
         print(f"   Apnea segments: {stats['total_apnea_segments']}")
         print(f"   Normal segments: {stats['total_normal_segments']}")
         
-        # Visualize data distribution
-        print("📊 Generating data distribution visualization...")
-        self.data_loader.visualize_patient_distribution(save_path="dataset_distribution.png")
+        # Visualize data distribution, unless the existing plot is newer than the data
+        plot_path = "dataset_distribution.png"
+        if os.path.exists(plot_path) and os.path.getmtime(plot_path) >= self.data_loader.source_mtime():
+            print(f"📊 Data distribution visualization up to date at {plot_path}")
+        else:
+            print("📊 Generating data distribution visualization...")
+            self.data_loader.visualize_patient_distribution(save_path=plot_path)
+    
+    def _features_key(self, patient_ids: List[str]) -> str:
+        """Cache key for precomputed features: dataset, feature params and each patient's segments and row order."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str((os.path.abspath(self.data_loader.data_dir), self.preprocessor.target_sr,
+                      self.preprocessor.segment_duration, 128, 512, 2048)).encode())
+        for pid in patient_ids:
+            segments = self.data_loader.patient_data[pid]['segments']
+            fingerprint = getattr(segments, 'fingerprint', None)
+            h.update(f"{pid}:{fingerprint() if fingerprint is not None else len(segments)}|".encode())
+        return h.hexdigest()
+    
+    def precompute_features(self, patient_ids: List[str], chunk_size: int = 64) -> None:
+        """Extract features for the given patients' segments, rows in that order, into an on-disk float16 memmap.
+        
+        The file is keyed on the dataset, so a later run over unchanged data reuses it.
+        """
+        patient_ids = [pid for pid in patient_ids if pid in self.data_loader.patient_data]
+        offset = 0
+        for pid in patient_ids:
+            n_segments = len(self.data_loader.patient_data[pid]['segments'])
+            self.feature_slices[pid] = slice(offset, offset + n_segments)
+            offset += n_segments
+        total = offset
+        n_frames = 1 + self.preprocessor.segment_length // 512
+        
+        # Fresh unless a segment file changed after the features were written
+        out_path = os.path.join(self.model_save_dir, f"features-{self._features_key(patient_ids)}.npy")
+        if os.path.exists(out_path) and os.path.getmtime(out_path) >= self.data_loader.source_mtime():
+            self.features = np.load(out_path, mmap_mode='r')
+            print(f"✅ Reusing cached features from {out_path}")
+            return
+        
+        # Extract into a temporary file, so an interrupted run never leaves a valid-looking cache
+        print(f"🧮 Precomputing features for {total} segments...")
+        tmp_path = out_path + ".tmp"
+        self.features = np.lib.format.open_memmap(
+            tmp_path, mode='w+', dtype=np.float16, shape=(total, 128, n_frames)
+        )
+        
+        progress = dict(desc="Extracting features", unit="patient", mininterval=1.0, smoothing=0.05)
+        if torch.cuda.is_available():
+            # GPU frontend: one process keeps the device busy
+            for pid in tqdm(patient_ids, **progress):
+                _write_patient_features(self.preprocessor, self.data_loader.patient_data[pid]['segments'],
+                                        self.features, self.feature_slices[pid].start, chunk_size)
+        else:
+            # CPU: one task per patient across all cores; each worker writes its own rows of the
+            # memmap, so nothing but the file path and row offset crosses the process boundary
+            self.features.flush()
+            jobs = Parallel(n_jobs=os.cpu_count(), backend='loky', return_as='generator')(
+                delayed(_extract_patient_features)(
+                    self.data_loader.patient_data[pid]['segments'], tmp_path,
+                    self.feature_slices[pid].start, self.preprocessor.target_sr,
+                    self.preprocessor.segment_duration, chunk_size
+                )
+                for pid in patient_ids
+            )
+            for _ in tqdm(jobs, total=len(patient_ids), **progress):
+                pass
+        
+        self.features.flush()
+        del self.features
+        os.replace(tmp_path, out_path)
+        self.features = np.load(out_path, mmap_mode='r')
+        print(f"✅ Features cached at {out_path}")
     
     def setup_environment(self, patient_ids: List[str]) -> ApneaDetectionEnv:
         """Setup RL environment for training with progress tracking."""
@@ -76,19 +168,28 @@ class ApneaDetectionPipeline:
         
         # Get environment data
         print("📋 Creating environment data...")
-        env_data = self.data_loader.create_environment_data(patient_ids)
+        segments, labels = self.data_loader.create_environment_data(patient_ids)
         
-        if not env_data:
+        if len(labels) == 0:
             raise ValueError("No environment data available")
         
-        # Separate segments and labels
-        segments, labels = zip(*env_data)
+        # Precomputed features for these patients, in the same order as the segments. Rows are
+        # laid out split by split, so a split is one contiguous slice: a memmap view, with
+        # nothing read into RAM. Only an arbitrary subset of patients needs a copy
+        features = None
+        if self.features is not None:
+            slices = [self.feature_slices[pid] for pid in patient_ids if pid in self.feature_slices]
+            if slices and all(a.stop == b.start for a, b in zip(slices, slices[1:])):
+                features = self.features[slices[0].start:slices[-1].stop]
+            elif slices:
+                features = np.concatenate([self.features[sl] for sl in slices])
         
         # Create environment
         print("🏗️ Creating RL environment...")
         env = ApneaDetectionEnv(
-            audio_segments=list(segments),
-            labels=list(labels)
+            audio_segments=segments,
+            labels=labels,
+            features=features
         )
         
         print(f"✅ Environment created with {len(segments)} segments")
@@ -131,6 +232,15 @@ class ApneaDetectionPipeline:
         self.agent.save(model_path)
         print(f"💾 Trained agent saved to {model_path}")
         
+        # ONNX copy of the policy for deployment inference (picked up by CustomAudioTester)
+        try:
+            self.agent.export_onnx(f"{model_path}.onnx")
+        except Exception as e:
+            print(f"⚠️ ONNX export skipped: {e}")
+        
+        # Training is done; freeze and compile the policy for the evaluation loops
+        self.agent.compile_for_inference()
+        
         # Display training summary
         summary = self.agent.get_training_summary()
         print(f"\n📊 Training Summary:")
@@ -188,7 +298,7 @@ class ApneaDetectionPipeline:
         print("✂️ Segmenting audio...")
         segments = self.preprocessor.segment_audio(audio, sr)
         
-        if not segments:
+        if len(segments) == 0:
             raise ValueError("No valid segments extracted from audio")
         
         print(f"   Created {len(segments)} segments")
@@ -227,11 +337,16 @@ class ApneaDetectionPipeline:
         print("📊 Generating training progress visualization...")
         history = self.agent.training_history
         
+        # Plotting stack is only imported when a figure is actually drawn
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        
         fig, axes = plt.subplots(2, 3, figsize=(18, 12))
         
         # Episode rewards
         if history['episode_rewards']:
-            axes[0, 0].plot(history['episode_rewards'])
+            axes[0, 0].plot(history['episode_rewards'], rasterized=len(history['episode_rewards']) > 10_000)
             axes[0, 0].set_title('Episode Rewards')
             axes[0, 0].set_xlabel('Episode')
             axes[0, 0].set_ylabel('Total Reward')
@@ -239,7 +354,7 @@ class ApneaDetectionPipeline:
         
         # Episode lengths
         if history['episode_lengths']:
-            axes[0, 1].plot(history['episode_lengths'])
+            axes[0, 1].plot(history['episode_lengths'], rasterized=len(history['episode_lengths']) > 10_000)
             axes[0, 1].set_title('Episode Lengths')
             axes[0, 1].set_xlabel('Episode')
             axes[0, 1].set_ylabel('Length')
@@ -247,7 +362,7 @@ class ApneaDetectionPipeline:
         
         # ECE scores
         if history['ece_scores']:
-            axes[0, 2].plot(history['ece_scores'])
+            axes[0, 2].plot(history['ece_scores'], rasterized=len(history['ece_scores']) > 10_000)
             axes[0, 2].set_title('ECE Scores')
             axes[0, 2].set_xlabel('Episode')
             axes[0, 2].set_ylabel('ECE')
@@ -255,7 +370,7 @@ class ApneaDetectionPipeline:
         
         # Confidence scores
         if history['confidence_scores']:
-            axes[1, 0].plot(history['confidence_scores'])
+            axes[1, 0].plot(history['confidence_scores'], rasterized=len(history['confidence_scores']) > 10_000)
             axes[1, 0].set_title('Median Confidence Scores')
             axes[1, 0].set_xlabel('Episode')
             axes[1, 0].set_ylabel('Median Confidence')
@@ -297,7 +412,7 @@ Evaluations: {summary['evaluation_count']}
         plt.tight_layout()
         plt.savefig(save_path, dpi=300, bbox_inches='tight')
         print(f"💾 Training progress visualization saved to {save_path}")
-        plt.show()
+        plt.close(fig)
     
     def run_complete_pipeline(self) -> None:
         """Run the complete training and evaluation pipeline with enhanced progress tracking."""
@@ -311,6 +426,9 @@ Evaluations: {summary['evaluation_count']}
         print("\n📊 Splitting patients into train/validation/test sets...")
         train_patients, val_patients, test_patients = self.data_loader.split_patients()
         
+        # Extract every segment's features once, up front, laid out split by split
+        self.precompute_features(train_patients + val_patients + test_patients)
+        
         # Train agent
         self.train_agent(train_patients, val_patients)
         
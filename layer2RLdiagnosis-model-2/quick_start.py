@@ -6,7 +6,7 @@ Provides a simple interface to get started quickly.
 
 import os
 import sys
-from typing import Optional
+import importlib.util
 
 
 def print_banner():
@@ -32,10 +32,10 @@ def check_dependencies():
     missing_packages = []
     
     for package in required_packages:
-        try:
-            __import__(package)
+        # Locate the package without executing it (importing torch alone takes seconds)
+        if importlib.util.find_spec(package) is not None:
             print(f"   ✅ {package}")
-        except ImportError:
+        else:
             print(f"   ❌ {package} - MISSING")
             missing_packages.append(package)
     
@@ -48,6 +48,12 @@ def check_dependencies():
     return True
 
 
+def _present_files(path: str = ".") -> set:
+    """Names of the regular files in a directory, from a single directory scan."""
+    with os.scandir(path) as entries:
+        return {entry.name for entry in entries if entry.is_file()}
+
+
 def check_files():
     """Check if required files are present."""
     print("\n📁 Checking project files...")
@@ -58,9 +64,10 @@ def check_files():
     ]
     
     missing_files = []
+    present = _present_files()
     
     for file in required_files:
-        if os.path.exists(file):
+        if file in present:
             print(f"   ✅ {file}")
         else:
             print(f"   ❌ {file} - MISSING")
@@ -123,7 +130,7 @@ def test_custom_audio():
     print("\n🧪 Custom Audio Testing...")
     
     # Check if apnea.mp3 exists
-    if os.path.exists("apnea.mp3"):
+    if "apnea.mp3" in _present_files():
         print("✅ Found apnea.mp3 - testing on this file")
         try:
             from test_custom_audio import main as test_main
@@ -147,7 +154,7 @@ def view_dataset_stats():
         print("📥 Loading dataset (this may take a few minutes on first run)...")
         data_loader = ApneaDataLoader()
         
-        # Get statistics
+        # Get statistics (cached by the loader until a segment file changes)
         stats = data_loader.get_patient_statistics()
         
         print("\n📊 DATASET OVERVIEW:")
@@ -158,13 +165,21 @@ def view_dataset_stats():
         
         # Show patient details
         print(f"\n👥 PATIENT DETAILS:")
-        for patient_id, details in stats['patient_details'].items():
-            print(f"   {patient_id}: {details['total_segments']} segments "
-                  f"({details['apnea_segments']} apnea, {details['normal_segments']} normal)")
+        # One write for the whole table rather than a print per patient
+        lines = [
+            f"   {patient_id}: {details['total_segments']} segments "
+            f"({details['apnea_segments']} apnea, {details['normal_segments']} normal)"
+            for patient_id, details in stats['patient_details'].items()
+        ]
+        sys.stdout.write("\n".join(lines) + "\n")
         
-        # Visualize distribution
-        print("\n📈 Generating visualization...")
-        data_loader.visualize_patient_distribution(save_path="dataset_overview.png")
+        # Visualize distribution, unless the plot is newer than every segment file
+        plot_path = "dataset_overview.png"
+        if plot_path not in _present_files() or os.path.getmtime(plot_path) < data_loader.source_mtime():
+            print("\n📈 Generating visualization...")
+            data_loader.visualize_patient_distribution(save_path=plot_path)
+        else:
+            print(f"\n📈 Visualization up to date: {plot_path}")
         
     except Exception as e:
         print(f"❌ Error loading dataset: {e}")
@@ -177,10 +192,16 @@ def install_dependencies():
     
     try:
         import subprocess
-        import sys
+        import shutil
         
         print("📦 Installing from requirements.txt...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
+        if shutil.which("uv"):
+            # uv resolves and downloads wheels in parallel; target this interpreter's environment
+            subprocess.check_call(["uv", "pip", "install", "--python", sys.executable, "-r", "requirements.txt"])
+        else:
+            # A current pip downloads and installs noticeably faster than old bundled versions
+            subprocess.check_call([sys.executable, "-m", "pip", "install", "--upgrade", "pip"])
+            subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
         print("✅ Dependencies installed successfully!")
         
     except Exception as e:
@@ -192,7 +213,7 @@ def view_documentation():
     """View documentation."""
     print("\n📚 Documentation...")
     
-    if os.path.exists("README.md"):
+    if "README.md" in _present_files():
         print("📖 README.md found. Opening...")
         try:
             import subprocess
@@ -1,24 +1,29 @@
+import importlib.util
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from stable_baselines3 import PPO
-from stable_baselines3.common.policies import BasePolicy
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from stable_baselines3.common.policies import ActorCriticPolicy
 from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
 from stable_baselines3.common.utils import get_device
 from stable_baselines3.common.callbacks import BaseCallback
 from typing import Dict, List, Tuple, Optional, Union, Type
 import gymnasium as gym
-from tqdm import tqdm
 import time
 
+from apnea_detection_env import LogMelFrontend
+
 
 class ApneaFeatureExtractor(BaseFeaturesExtractor):
-    """Feature extractor for mel-spectrogram inputs."""
+    """Feature extractor for mel-spectrogram (or raw waveform) inputs."""
     
     def __init__(self, observation_space: gym.spaces.Box, features_dim: int = 256):
         super().__init__(observation_space, features_dim)
         
+        # Raw-waveform observations get the mel frontend inside the network
+        self.frontend = LogMelFrontend() if len(observation_space.shape) == 1 else None
+        
         # CNN layers for mel-spectrogram processing
         self.conv1 = nn.Conv2d(1, 32, kernel_size=(3, 3), padding=1)
         self.conv2 = nn.Conv2d(32, 64, kernel_size=(3, 3), padding=1)
@@ -30,10 +35,10 @@ class ApneaFeatureExtractor(BaseFeaturesExtractor):
         self.bn3 = nn.BatchNorm2d(128)
         
         # Pooling
-        self.pool = nn.AdaptiveAvgPool2d((4, 4))
+        self.pool = nn.AdaptiveAvgPool2d((1, 1))
         
         # Calculate the size after convolutions and pooling
-        conv_output_size = 128 * 4 * 4
+        conv_output_size = 128  # Global average pool: one value per conv3 channel
         
         # Fully connected layers
         self.fc1 = nn.Linear(conv_output_size, 512)
@@ -42,107 +47,157 @@ class ApneaFeatureExtractor(BaseFeaturesExtractor):
         # Dropout for regularization
         self.dropout = nn.Dropout(0.3)
         
+        # Set once the BatchNorms have been folded into the convs for inference
+        self.eval_fused = False
+    
+    def fuse_conv_bn(self) -> None:
+        """Fold each eval-mode BatchNorm into the conv before it (inference only; not reversible)."""
+        if self.training or self.eval_fused:
+            return
+        for conv, bn in (('conv1', 'bn1'), ('conv2', 'bn2'), ('conv3', 'bn3')):
+            setattr(self, conv, fuse_conv_bn_eval(getattr(self, conv), getattr(self, bn)))
+            setattr(self, bn, nn.Identity())
+        self.eval_fused = True
+    
     def forward(self, observations: torch.Tensor) -> torch.Tensor:
-        # Add channel dimension if not present
-        if observations.dim() == 3:
-            observations = observations.unsqueeze(1)  # (batch, 1, n_mels, n_frames)
-        
-        # Apply convolutions
-        x = F.relu(self.bn1(self.conv1(observations)))
-        x = F.relu(self.bn2(self.conv2(x)))
-        x = F.relu(self.bn3(self.conv3(x)))
-        
-        # Pooling
-        x = self.pool(x)
-        
-        # Flatten
-        x = x.view(x.size(0), -1)
-        
-        # Fully connected layers
-        x = F.relu(self.fc1(x))
-        x = self.dropout(x)
-        x = F.relu(self.fc2(x))
+        # Observations may arrive as float16; upcast once before the convolutions
+        observations = observations.float()
+        if self.frontend is not None:
+            with torch.no_grad():
+                observations = self.frontend(observations).unsqueeze(1)  # (batch, 1, n_mels, n_frames)
+        observations = observations.contiguous(memory_format=torch.channels_last)
+        
+        # Conv stack and FC layers in bf16 on CUDA (tensor cores); fp32 elsewhere
+        with torch.autocast(device_type=observations.device.type, dtype=torch.bfloat16,
+                            enabled=observations.is_cuda):
+            # Apply convolutions
+            x = F.relu(self.bn1(self.conv1(observations)))
+            x = F.relu(self.bn2(self.conv2(x)))
+            x = F.relu(self.bn3(self.conv3(x)))
+            
+            # Pooling
+            x = self.pool(x)
+            
+            # Flatten
+            x = x.flatten(1)  # (batch, 128); layout-agnostic, unlike view, for channels_last
+            
+            # Fully connected layers
+            x = F.relu(self.fc1(x))
+            x = self.dropout(x)
+            x = F.relu(self.fc2(x))
         
-        return x
+        # Heads stay in fp32
+        return x.float()
 
 
-class ApneaPolicy(BasePolicy):
-    """Custom policy for apnea detection with confidence awareness."""
+class ApneaHeadTrunk(nn.Module):
+    """
+    Hidden layers of the action, confidence and value heads, stacked into one
+    (features_dim -> 3 * head_hidden) GEMM. Stands in for SB3's MlpExtractor:
+    forward gives (latent_pi, latent_vf), split also the confidence latent.
+    """
+    
+    def __init__(self, features_dim: int, head_hidden: int = 128, dropout: float = 0.2):
+        super().__init__()
+        self.head_hidden = head_hidden
+        self.latent_dim_pi = head_hidden
+        self.latent_dim_vf = head_hidden
+        self.shared_trunk = nn.Linear(features_dim, 3 * head_hidden)
+        self.trunk_act = nn.ReLU()
+        self.trunk_dropout = nn.Dropout(dropout)
+    
+    def split(self, features: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """(action, confidence, value) latents from one trunk pass."""
+        h = self.trunk_dropout(self.trunk_act(self.shared_trunk(features)))
+        return h.split(self.head_hidden, dim=-1)
+    
+    def forward(self, features: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        h_action, _, h_value = self.split(features)
+        return h_action, h_value
+    
+    def forward_actor(self, features: torch.Tensor) -> torch.Tensor:
+        return self.split(features)[0]
+    
+    def forward_critic(self, features: torch.Tensor) -> torch.Tensor:
+        return self.split(features)[2]
+
+
+class ApneaPolicy(ActorCriticPolicy):
+    """
+    Actor-critic policy for apnea detection with confidence awareness.
+    
+    SB3 drives training through the standard forward / evaluate_actions / predict_values
+    contract (action_net and value_net sit on the trunk's action and value latents); the
+    confidence head is read alongside the action by _predict_with_confidence.
+    """
+    
+    head_hidden = 128
     
     def __init__(self, observation_space: gym.spaces.Box, action_space: gym.spaces.Discrete,
-                 lr_schedule: callable, net_arch: Optional[List[int]] = None,
-                 activation_fn: Type[nn.Module] = nn.ReLU, *args, **kwargs):
-        
+                 lr_schedule: callable, *args, **kwargs):
+        kwargs.setdefault('features_extractor_class', ApneaFeatureExtractor)
         super().__init__(observation_space, action_space, lr_schedule, *args, **kwargs)
         
-        # Feature extractor
-        self.features_extractor = ApneaFeatureExtractor(observation_space)
-        
-        # Action head (policy)
-        self.action_net = nn.Sequential(
-            nn.Linear(self.features_extractor.features_dim, 128),
-            nn.ReLU(),
-            nn.Dropout(0.2),
-            nn.Linear(128, action_space.n)
-        )
-        
-        # Confidence head (for diagnosis confidence)
-        self.confidence_net = nn.Sequential(
-            nn.Linear(self.features_extractor.features_dim, 128),
-            nn.ReLU(),
-            nn.Dropout(0.2),
-            nn.Linear(128, 1),
-            nn.Sigmoid()  # Output confidence between 0 and 1
-        )
-        
-        # Value head
-        self.value_net = nn.Sequential(
-            nn.Linear(self.features_extractor.features_dim, 128),
-            nn.ReLU(),
-            nn.Dropout(0.2),
-            nn.Linear(128, 1)
-        )
-        
-    def forward(self, obs: torch.Tensor, deterministic: bool = False) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-        """Forward pass through the policy network."""
-        features = self.features_extractor(obs)
-        
-        # Action logits
-        action_logits = self.action_net(features)
-        
-        # Confidence (for diagnosis)
-        confidence = self.confidence_net(features)
-        
-        # Value
-        value = self.value_net(features)
-        
-        return action_logits, confidence, value
-    
-    def forward_actor(self, obs: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
-        """Forward pass for actor (action and confidence)."""
-        features = self.features_extractor(obs)
-        action_logits = self.action_net(features)
-        confidence = self.confidence_net(features)
-        return action_logits, confidence
+        # NHWC conv weights so cuDNN can pick tensor-core kernels; converted after SB3's
+        # orthogonal init, which needs contiguous weights. Parameters are updated in place,
+        # so the optimizer built by _build still holds them
+        self.features_extractor.to(memory_format=torch.channels_last)
     
-    def forward_critic(self, obs: torch.Tensor) -> torch.Tensor:
-        """Forward pass for critic (value)."""
-        features = self.features_extractor(obs)
-        return self.value_net(features)
+    def _build_mlp_extractor(self) -> None:
+        """Shared head trunk plus the confidence head (built here so the optimizer covers it)."""
+        self.mlp_extractor = ApneaHeadTrunk(self.features_dim, self.head_hidden)
+        
+        # Confidence head (for diagnosis confidence), squashed to (0, 1) by a sigmoid
+        self.conf_out = nn.Linear(self.head_hidden, 1)
     
-    def _predict(self, observation: torch.Tensor, deterministic: bool = False) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
-        """Predict action and confidence."""
-        action_logits, confidence = self.forward_actor(observation)
+    def _predict_with_confidence(self, observation: torch.Tensor,
+                                 deterministic: bool = False) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Actions and diagnosis confidences for a batch of observations (the agent's inference path)."""
+        h_action, h_confidence, _ = self.mlp_extractor.split(self.features_extractor(observation))
+        action_logits = self.action_net(h_action)
+        confidence = torch.sigmoid(self.conf_out(h_confidence))
         
         if deterministic:
             action = torch.argmax(action_logits, dim=1)
         else:
-            action_probs = F.softmax(action_logits, dim=1)
-            action = torch.multinomial(action_probs, 1).squeeze(-1)
+            # Gumbel-max: argmax(logits + Gumbel noise) is a categorical sample from softmax(logits)
+            noise = -torch.log(-torch.log(torch.rand_like(action_logits).clamp_(1e-20, 1.0)))
+            action = (action_logits + noise).argmax(dim=1)
         
         return action, confidence.squeeze(-1)
 
 
+class _DeterministicPredict(nn.Module):
+    """An ApneaPolicy's deterministic obs -> (action, confidence) path as a plain module, for export."""
+    
+    def __init__(self, policy: ApneaPolicy):
+        super().__init__()
+        self.policy = policy
+    
+    def forward(self, obs: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.policy._predict_with_confidence(obs, deterministic=True)
+
+
+class _RunningStats:
+    """Count, mean and variance of a stream of values (Welford's online algorithm)."""
+    
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+    
+    def update(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+    
+    @property
+    def std(self) -> float:
+        """Population standard deviation, matching np.std."""
+        return (self._m2 / self.count) ** 0.5 if self.count else 0.0
+
+
 class EnhancedTrainingCallback(BaseCallback):
     """Enhanced callback for monitoring training progress with tqdm."""
     
@@ -152,24 +207,33 @@ class EnhancedTrainingCallback(BaseCallback):
         self.eval_results = []
         self.pbar = None
         self.start_time = None
+        # Timestep at which the next evaluation is due
+        self._next_eval = eval_freq
         
     def _on_training_start(self) -> None:
         """Called at the start of training."""
         self.start_time = time.time()
+        self._next_eval = self.model.num_timesteps + self.eval_freq
         if self.verbose > 0:
+            from tqdm import tqdm
             print(f"🚀 Starting training with {self.locals['total_timesteps']} timesteps")
             self.pbar = tqdm(total=self.locals['total_timesteps'], 
                            desc="Training Progress", 
                            unit="steps",
+                           mininterval=1.0,
+                           smoothing=0.05,
                            bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]')
     
+    def _on_rollout_end(self) -> None:
+        """Advance the progress bar once per collected rollout."""
+        if self.pbar:
+            self.pbar.update(self.model.n_steps * self.model.n_envs)
+    
     def _on_step(self) -> bool:
         """Called after each step."""
-        if self.pbar:
-            self.pbar.update(self.locals['self'].n_steps)
-        
-        # Evaluate at specified frequency
-        if self.locals['self'].num_timesteps % self.eval_freq == 0:
+        # Evaluate at specified frequency (a threshold compare, not a modulo, on the hot path)
+        if self.model.num_timesteps >= self._next_eval:
+            self._next_eval += self.eval_freq
             self._evaluate_current_performance()
         
         return True
@@ -177,25 +241,25 @@ class EnhancedTrainingCallback(BaseCallback):
     def _evaluate_current_performance(self) -> None:
         """Evaluate current performance."""
         try:
-            eval_env = self.locals['self'].env
+            eval_env = self.model.env
             if hasattr(eval_env, 'get_episode_results'):
                 obs, info = eval_env.reset()
                 done = False
                 while not done:
-                    action, _ = self.locals['self'].predict(obs, deterministic=True)
+                    action, _ = self.model.predict(obs, deterministic=True)
                     obs, _, done, _, _ = eval_env.step(action)
                 
                 results = eval_env.get_episode_results()
                 if results:
                     self.eval_results.append({
-                        'timestep': self.locals['self'].num_timesteps,
+                        'timestep': self.model.num_timesteps,
                         'ece': results.get('ece', 0),
                         'severity': results.get('severity', 0),
                         'median_confidence': results.get('median_confidence', 0)
                     })
                     
                     if self.verbose > 0:
-                        print(f"\n📊 Evaluation at {self.locals['self'].num_timesteps} steps:")
+                        print(f"\n📊 Evaluation at {self.model.num_timesteps} steps:")
                         print(f"   ECE: {results.get('ece', 0):.4f}")
                         print(f"   Severity: {results.get('severity', 0):.4f}")
                         print(f"   Median Confidence: {results.get('median_confidence', 0):.4f}")
@@ -224,15 +288,22 @@ class ApneaRLAgent:
         self.env = env
         self.device = get_device("auto")
         
-        # Create custom policy
+        # TF32 for any fp32 matmuls/convs left outside autocast, and autotuned cuDNN algorithms
+        # (input shapes are fixed by the observation space)
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cudnn.benchmark = True
+        
+        # Custom policy options, passed through by SB3 when it builds ApneaPolicy
         policy_kwargs = {
             "features_extractor_class": ApneaFeatureExtractor,
             "features_extractor_kwargs": {"features_dim": 256}
         }
         
         # Initialize PPO agent with enhanced parameters
+        from stable_baselines3 import PPO
         self.agent = PPO(
-            "MlpPolicy",  # We'll override this with custom policy
+            ApneaPolicy,
             env,
             learning_rate=learning_rate,
             n_steps=n_steps,
@@ -244,16 +315,11 @@ class ApneaRLAgent:
             policy_kwargs=policy_kwargs,
             verbose=1,
             device=self.device,
-            tensorboard_log="./tensorboard_logs/"  # Add tensorboard logging
+            # Tensorboard logging when it's installed (SB3 refuses to learn() without it otherwise)
+            tensorboard_log="./tensorboard_logs/" if importlib.util.find_spec("tensorboard") else None
         )
         
-        # Replace policy with custom one
-        self.agent.policy = ApneaPolicy(
-            env.observation_space,
-            env.action_space,
-            self.agent.lr_schedule,
-            device=self.device
-        )
+        self._reset_inference_state()
         
         # Training history
         self.training_history = {
@@ -264,6 +330,22 @@ class ApneaRLAgent:
             'training_timesteps': [],
             'evaluation_results': []
         }
+        # Running summaries of the per-episode series, so get_training_summary is O(1)
+        self._running = {key: _RunningStats() for key in
+                         ('episode_rewards', 'episode_lengths', 'ece_scores', 'confidence_scores')}
+    
+    def _reset_inference_state(self) -> None:
+        """Drop the compiled predict path, the captured graph and the buffers it reads/writes."""
+        # Compiled inference path and, on CUDA, the captured deterministic predict graph with
+        # its static outputs; both set up by compile_for_inference()
+        self._predict_fn = None
+        self._predict_graph = None
+        self._graph_outputs = None
+        
+        # Pinned host staging buffers (and the single observation's device twin) for GPU transfers
+        self._obs_pin = None
+        self._obs_dev = None
+        self._batch_pin = None
     
     def train(self, total_timesteps: int, callback=None, show_progress: bool = True) -> None:
         """Train the agent with enhanced progress tracking."""
@@ -288,70 +370,228 @@ class ApneaRLAgent:
     def predict(self, observation: np.ndarray, deterministic: bool = False) -> Tuple[int, float]:
         """Predict action and confidence for a given observation."""
         # Convert to tensor
-        obs_tensor = torch.FloatTensor(observation).unsqueeze(0).to(self.device)
+        if self.device.type == 'cuda':
+            # Persistent pinned host and device buffers: the copy is an async DMA into a fixed
+            # address, with no per-step allocation
+            if self._obs_pin is None or self._obs_pin.shape[1:] != observation.shape:
+                self._obs_pin = torch.empty((1, *observation.shape), dtype=torch.float32).pin_memory()
+                self._obs_dev = torch.empty_like(self._obs_pin, device=self.device)
+                # A captured graph reads the old device buffer
+                self._predict_graph = None
+            self._obs_pin[0].numpy()[...] = observation
+            obs_tensor = self._obs_dev.copy_(self._obs_pin, non_blocking=True)
+            
+            # Replay the captured forward: one launch instead of one per kernel
+            if deterministic and self._predict_graph is not None:
+                self._predict_graph.replay()
+                action, confidence = self._graph_outputs
+                return action.item(), confidence.item()
+        else:
+            obs_tensor = torch.from_numpy(np.array(observation, dtype=np.float32)).unsqueeze(0)
         
-        # Get prediction
-        action, confidence = self.agent.policy._predict(obs_tensor, deterministic)
+        # Get prediction (compiled path once the policy is frozen for inference)
+        predict_fn = self._predict_fn or self.agent.policy._predict_with_confidence
+        with torch.inference_mode():
+            action, confidence = predict_fn(obs_tensor, deterministic)
         
         return action.item(), confidence.item()
     
-    def evaluate_episode(self, env: gym.Env, show_progress: bool = True) -> Dict:
-        """Evaluate the agent on a single episode with progress tracking."""
+    def predict_batch(self, observations: np.ndarray,
+                      deterministic: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Predict actions and confidences for a (batch, *obs_shape) array in one forward pass."""
+        n = len(observations)
+        if self.device.type == 'cuda':
+            # Grow-only pinned staging buffer; a short final batch uses a prefix of it
+            if (self._batch_pin is None or self._batch_pin.shape[1:] != observations.shape[1:]
+                    or len(self._batch_pin) < n):
+                self._batch_pin = torch.empty(observations.shape, dtype=torch.float32).pin_memory()
+            self._batch_pin[:n].numpy()[...] = observations
+            obs_tensor = self._batch_pin[:n].to(self.device, non_blocking=True)
+        else:
+            obs_tensor = torch.from_numpy(np.array(observations, dtype=np.float32))
+        
+        predict_fn = self._predict_fn or self.agent.policy._predict_with_confidence
+        with torch.inference_mode():
+            actions, confidences = predict_fn(obs_tensor, deterministic)
+        
+        return actions.cpu().numpy(), confidences.float().cpu().numpy()
+    
+    def compile_for_inference(self, warmup_steps: int = 3, quantize: bool = True) -> None:
+        """Freeze the policy and compile its predict path for batch-1 evaluation.
+        
+        BatchNorms are folded into the convs (and, on CPU with ``quantize``, Linear layers
+        become dynamic int8), so save the agent before calling this.
+        """
+        self._reset_inference_state()
+        self.agent.policy.set_training_mode(False)
+        self.agent.policy.features_extractor.fuse_conv_bn()
+        if quantize and self.device.type == 'cpu':
+            self._quantize_linears()
+        if not hasattr(torch, 'compile'):
+            return
+        
+        # Compile the bound method rather than wrapping the policy module; nothing inside it
+        # is compiled separately. On CUDA the batch-1 deterministic path is captured into our
+        # own graph below, so the compiled code must not manage CUDA graphs itself. CPU uses
+        # Inductor's default mode (reduce-overhead is CUDA graphs, meaningless there)
+        on_cuda = self.device.type == 'cuda'
+        self._predict_fn = torch.compile(
+            self.agent.policy._predict_with_confidence,
+            mode='max-autotune-no-cudagraphs' if on_cuda else None
+        )
+        
+        # Warm up so kernels are compiled before the evaluation loop. Inductor compiles lazily,
+        # so a missing toolchain (e.g. no C++ compiler on a CPU-only box) surfaces here
+        dummy = np.zeros(self.env.observation_space.shape, dtype=np.float32)
+        try:
+            for _ in range(warmup_steps):
+                self.predict(dummy, deterministic=True)
+        except Exception as e:
+            print(f"⚠️ torch.compile unavailable ({type(e).__name__}: {e}); using the eager predict path")
+            self._predict_fn = None
+            return
+        
+        if on_cuda:
+            self._capture_predict_graph(warmup_steps)
+    
+    def export_onnx(self, path: str, opset_version: int = 17) -> None:
+        """Export deterministic prediction (input -> action, confidence) to ONNX with a dynamic batch axis.
+        
+        Exports a fused fp32 CPU copy of the policy, so the agent itself is left untouched; call
+        before compile_for_inference, whose int8 Linear layers can't be exported.
+        """
+        # Rebuilt from its constructor parameters rather than deep-copied: after training, the
+        # policy's action distribution holds non-leaf tensors that can't be deep-copied
+        source = self.agent.policy
+        policy = type(source)(**source._get_constructor_parameters())
+        policy.load_state_dict(source.state_dict())
+        policy = policy.cpu()
+        policy.set_training_mode(False)
+        policy.features_extractor.fuse_conv_bn()
+        
+        dummy = torch.zeros((1, *self.env.observation_space.shape), dtype=torch.float32)
+        torch.onnx.export(
+            _DeterministicPredict(policy), (dummy,), path,
+            input_names=['input'], output_names=['action', 'confidence'],
+            dynamic_axes={'input': {0: 'batch'}, 'action': {0: 'batch'}, 'confidence': {0: 'batch'}},
+            opset_version=opset_version
+        )
+        print(f"📦 Policy exported to {path}")
+    
+    def _quantize_linears(self) -> None:
+        """Swap the inference path's Linear layers for dynamic int8 ones (int8 GEMMs on CPU)."""
+        from torch.ao.quantization import quantize_dynamic
+        quantize_dynamic(self.agent.policy, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    
+    def _capture_predict_graph(self, warmup_steps: int) -> None:
+        """Capture deterministic predict on the persistent device buffer into a CUDA graph."""
+        # Warm up on a side stream, as graph capture requires
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream), torch.inference_mode():
+            for _ in range(warmup_steps):
+                self._predict_fn(self._obs_dev, True)
+        torch.cuda.current_stream().wait_stream(stream)
+        
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph), torch.inference_mode():
+            self._graph_outputs = self._predict_fn(self._obs_dev, True)
+        self._predict_graph = graph
+    
+    def evaluate_episode(self, env: gym.Env, show_progress: bool = True, batch_size: int = 256) -> Dict:
+        """Evaluate the agent on a single episode with progress tracking.
+        
+        Observations don't depend on the actions taken (each step advances to the next
+        segment), so for envs exposing their ``features`` the policy is run on batches of
+        upcoming observations and the env is then stepped through the batch's actions.
+        """
         obs, info = env.reset()
         done = False
-        total_reward = 0
         episode_length = 0
-        predictions = []
-        
-        # Progress bar for episode evaluation
+        features = getattr(env, 'features', None) if batch_size > 1 else None
+        batch_actions = batch_confidences = ()
+        k = 0
+        
+        # Per-step records in preallocated arrays; an episode takes at most one step per segment
+        total_steps = len(getattr(env, 'labels', ()))
+        capacity = total_steps or 1024
+        actions = np.empty(capacity, dtype=np.int8)
+        confidences = np.empty(capacity, dtype=np.float32)
+        rewards = np.empty(capacity, dtype=np.float32)
+        
+        # Progress bar for episode evaluation, refreshed in batches of steps
+        update_every = max(1, total_steps // 500)
         if show_progress:
-            pbar = tqdm(desc="Episode Evaluation", unit="steps")
+            from tqdm import tqdm
+            pbar = tqdm(total=total_steps or None, desc="Episode Evaluation", unit="steps",
+                        mininterval=1.0, miniters=update_every, smoothing=0.05)
         
         while not done:
             # Get action and confidence
-            action, confidence = self.predict(obs, deterministic=True)
+            if features is not None:
+                if k == len(batch_actions):
+                    batch_actions, batch_confidences = self.predict_batch(
+                        features[episode_length:episode_length + batch_size], deterministic=True
+                    )
+                    k = 0
+                action, confidence = int(batch_actions[k]), float(batch_confidences[k])
+                k += 1
+            else:
+                action, confidence = self.predict(obs, deterministic=True)
             
             # Take step
             obs, reward, done, truncated, info = env.step(action)
             
-            # Record prediction
-            if action == 1:  # DIAGNOSE action
-                predictions.append({
-                    'action': action,
-                    'confidence': confidence,
-                    'reward': reward
-                })
-            
-            total_reward += reward
+            if episode_length == capacity:
+                capacity *= 2
+                actions, confidences, rewards = (np.resize(a, capacity) for a in (actions, confidences, rewards))
+            actions[episode_length] = action
+            confidences[episode_length] = confidence
+            rewards[episode_length] = reward
             episode_length += 1
             
-            if show_progress:
-                pbar.update(1)
+            if show_progress and episode_length % update_every == 0:
+                pbar.update(update_every)
                 pbar.set_postfix({
-                    'reward': f"{total_reward:.3f}",
+                    'reward': f"{rewards[:episode_length].sum():.3f}",
                     'steps': episode_length
-                })
+                }, refresh=False)
         
         if show_progress:
+            pbar.update(episode_length - pbar.n)
             pbar.close()
         
-        # Get episode results
-        episode_results = env.get_episode_results()
+        results = self.summarize_episode(
+            actions[:episode_length], confidences[:episode_length], rewards[:episode_length],
+            env.get_episode_results()
+        )
         
         # Update training history
-        self.training_history['episode_rewards'].append(total_reward)
-        self.training_history['episode_lengths'].append(episode_length)
+        self._record('episode_rewards', results['total_reward'])
+        self._record('episode_lengths', episode_length)
         self.training_history['training_timesteps'].append(episode_length)
         
+        episode_results = results['episode_results']
         if episode_results:
-            self.training_history['ece_scores'].append(episode_results.get('ece', 0))
-            self.training_history['confidence_scores'].append(episode_results.get('median_confidence', 0))
+            self._record('ece_scores', episode_results.get('ece', 0))
+            self._record('confidence_scores', episode_results.get('median_confidence', 0))
         
+        return results
+    
+    @staticmethod
+    def summarize_episode(actions: np.ndarray, confidences: np.ndarray, rewards: np.ndarray,
+                          episode_results: Dict) -> Dict:
+        """Episode summary from its per-step actions, confidences and rewards plus the env's results."""
+        # DIAGNOSE steps, gathered in one masked pass
+        diagnose = actions == 1
         return {
-            'total_reward': total_reward,
-            'episode_length': episode_length,
+            'total_reward': float(rewards.sum(dtype=np.float64)),
+            'episode_length': len(actions),
             'episode_results': episode_results,
-            'predictions': predictions
+            'predictions': [
+                {'action': 1, 'confidence': float(c), 'reward': float(r)}
+                for c, r in zip(confidences[diagnose], rewards[diagnose])
+            ]
         }
     
     def save(self, path: str) -> None:
@@ -361,28 +601,29 @@ class ApneaRLAgent:
     
     def load(self, path: str) -> None:
         """Load a trained agent."""
-        self.agent = PPO.load(path)
-        # Ensure policy is custom
-        if not isinstance(self.agent.policy, ApneaPolicy):
-            self.agent.policy = ApneaPolicy(
-                self.env.observation_space,
-                self.env.action_space,
-                self.agent.lr_schedule,
-                device=self.device
-            )
+        from stable_baselines3 import PPO
+        # The saved policy class is ApneaPolicy, so SB3 rebuilds it (and its weights) directly
+        self.agent = PPO.load(path, device=self.device)
+        self._reset_inference_state()
         print(f"📂 Agent loaded from {path}")
     
+    def _record(self, key: str, value: float) -> None:
+        """Append to a history series (kept for plotting) and fold it into its running stats."""
+        self.training_history[key].append(value)
+        self._running[key].update(float(value))
+    
     def get_training_summary(self) -> Dict:
         """Get a summary of training performance."""
-        if not self.training_history['episode_rewards']:
+        rewards = self._running['episode_rewards']
+        if not rewards.count:
             return {"status": "No training data available"}
         
         return {
-            "total_episodes": len(self.training_history['episode_rewards']),
-            "mean_reward": np.mean(self.training_history['episode_rewards']),
-            "std_reward": np.std(self.training_history['episode_rewards']),
-            "mean_episode_length": np.mean(self.training_history['episode_lengths']),
-            "mean_ece": np.mean(self.training_history['ece_scores']) if self.training_history['ece_scores'] else 0,
-            "mean_confidence": np.mean(self.training_history['confidence_scores']) if self.training_history['confidence_scores'] else 0,
+            "total_episodes": rewards.count,
+            "mean_reward": rewards.mean,
+            "std_reward": rewards.std,
+            "mean_episode_length": self._running['episode_lengths'].mean,
+            "mean_ece": self._running['ece_scores'].mean,
+            "mean_confidence": self._running['confidence_scores'].mean,
             "evaluation_count": len(self.training_history['evaluation_results'])
         }
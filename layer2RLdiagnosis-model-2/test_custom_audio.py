@@ -4,87 +4,264 @@ Utility script for testing the trained RL agent on custom audio files.
 """
 
 import os
+import hashlib
+import mmap
 import numpy as np
 import torch
-import matplotlib.pyplot as plt
-import librosa
-import soundfile as sf
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+from joblib import Parallel, delayed
 import warnings
-warnings.filterwarnings('ignore')
 
-# Import our custom modules
-from data_loader import AudioPreprocessor
-from apnea_detection_env import ApneaDetectionEnv
-from rl_agent import ApneaRLAgent
+# Import our custom modules; librosa/torchaudio/SB3 emit deprecation noise on import
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from data_loader import AudioPreprocessor
+    from apnea_detection_env import ApneaDetectionEnv
+    from rl_agent import ApneaRLAgent
+
+
+def _cache_path(audio_path: str, target_sr: int, segment_duration: float,
+                cache_dir: str, cache_format: str) -> str:
+    """Cache file for an audio file: blake2b of its bytes plus the preprocessing params."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(audio_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                h.update(data)
+    h.update(f"{target_sr}:{segment_duration}".encode())
+    return os.path.join(cache_dir, f"{h.hexdigest()}.{cache_format}")
+
+
+def _load_segments(preprocessor: AudioPreprocessor, audio_path: str,
+                   cache: Optional[Dict] = None) -> Tuple[np.ndarray, int]:
+    """Decoded (n_segments, segment_length) audio and its sample rate, from the cache when possible.
+    
+    ``cache`` holds cache_dir, cache_format and regenerate; None disables caching.
+    """
+    cache_path = None
+    if cache is not None:
+        cache_format = cache['cache_format']
+        cache_path = _cache_path(audio_path, preprocessor.target_sr, preprocessor.segment_duration,
+                                 cache['cache_dir'], cache_format)
+        if os.path.exists(cache_path) and not cache['regenerate']:
+            if cache_format == "npz":
+                segments = np.load(cache_path)['segments']
+            else:
+                segments = np.load(cache_path, mmap_mode='r')
+            print(f"Loaded {len(segments)} cached segments from {cache_path}")
+            return segments, preprocessor.target_sr
+    
+    audio, sr = preprocessor.load_audio(audio_path)
+    print(f"Audio loaded: {len(audio)} samples, {sr} Hz sample rate")
+    segments = preprocessor.segment_audio(audio, sr)
+    
+    if cache_path and len(segments) > 0:
+        os.makedirs(cache['cache_dir'], exist_ok=True)
+        if cache_format == "npz":
+            np.savez_compressed(cache_path, segments=segments)
+        else:
+            np.save(cache_path, segments)
+    return segments, sr
+
+
+def _preprocess_one(audio_path: str, target_sr: int, segment_duration: float,
+                    cache: Optional[Dict]) -> Tuple[np.ndarray, int]:
+    """Worker: decode and segment one audio file; an unreadable file yields no segments."""
+    preprocessor = AudioPreprocessor(target_sr=target_sr, segment_duration=segment_duration)
+    try:
+        return _load_segments(preprocessor, audio_path, cache)
+    except Exception as e:
+        print(f"Error loading audio {audio_path}: {e}")
+        return np.empty((0, preprocessor.segment_length), dtype=np.float32), target_sr
 
 
 class CustomAudioTester:
     """Test the trained RL agent on custom audio files."""
     
-    def __init__(self, model_path: str = "models/apnea_detection_agent"):
+    def __init__(self, model_path: str = "models/apnea_detection_agent", cache_features: bool = True,
+                 cache_format: str = "npz", cache_regenerate: bool = False, cache_dir: str = "cache",
+                 quantize: bool = True):
         self.model_path = model_path
+        # Dynamic int8 Linear layers for the PyTorch agent on CPU-only machines
+        self.quantize = quantize
         self.preprocessor = AudioPreprocessor()
         self.agent = None
         
+        # On-disk cache of decoded, segmented audio keyed by file content and preprocessing params;
+        # "npz" is compressed, "npy" is uncompressed and memory-mapped on load
+        if cache_format not in ("npz", "npy"):
+            raise ValueError(f"Unsupported cache_format: {cache_format}")
+        self.cache_features = cache_features
+        self.cache_format = cache_format
+        self.cache_regenerate = cache_regenerate
+        self.cache_dir = cache_dir
+        
+        # Prefer an exported ONNX policy under ONNX Runtime; otherwise load the PyTorch agent
+        self._ort = None
+        onnx_path = f"{model_path}.onnx"
+        if os.path.exists(onnx_path):
+            self.load_onnx(onnx_path)
+        
         # Load trained agent if available
-        if os.path.exists(model_path):
+        if self._ort is None and os.path.exists(model_path):
             self.load_agent()
     
     def load_agent(self) -> None:
         """Load the trained agent."""
         try:
-            # Create a dummy environment for loading
+            # Create a dummy environment for loading; its one segment's features are given
+            # directly, so no feature frontend is built or compiled
             dummy_env = ApneaDetectionEnv(
                 audio_segments=[np.zeros(160000)],  # 10 seconds at 16kHz
-                labels=[0]
+                labels=[0],
+                features=np.zeros((1, 128, 313), dtype=np.float16)
             )
             
             self.agent = ApneaRLAgent(dummy_env)
             self.agent.load(self.model_path)
+            self.agent.compile_for_inference(quantize=self.quantize)
             print(f"Agent loaded from {self.model_path}")
             
         except Exception as e:
             print(f"Error loading agent: {e}")
             print("Please ensure the agent is trained first")
     
-    def test_audio_file(self, audio_path: str, segment_duration: float = 10.0) -> Dict:
+    def load_onnx(self, onnx_path: str) -> None:
+        """Load an exported policy (see ApneaRLAgent.export_onnx) into an ONNX Runtime session."""
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            print("onnxruntime not installed; falling back to the PyTorch agent")
+            return
+        
+        try:
+            available = ort.get_available_providers()
+            providers = [p for p in ('CUDAExecutionProvider', 'CPUExecutionProvider') if p in available]
+            self._ort = ort.InferenceSession(onnx_path, providers=providers)
+            print(f"ONNX policy loaded from {onnx_path} ({self._ort.get_providers()[0]})")
+        except Exception as e:
+            print(f"Error loading ONNX policy: {e}")
+    
+    def predict_batch_ort(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Deterministic actions and confidences for a (batch, 1, n_mels, n_frames) array via ONNX Runtime."""
+        actions, confidences = self._ort.run(None, {'input': np.ascontiguousarray(features, dtype=np.float32)})
+        return actions, confidences
+    
+    def _load_segments(self, audio_path: str) -> Tuple[np.ndarray, int]:
+        """Decoded (n_segments, segment_length) audio and its sample rate, from the cache when possible."""
+        return _load_segments(self.preprocessor, audio_path, self._cache_options())
+    
+    def _cache_options(self) -> Optional[Dict]:
+        """Cache settings in the form the module-level loaders take; None disables caching."""
+        if not self.cache_features:
+            return None
+        return {'cache_dir': self.cache_dir, 'cache_format': self.cache_format,
+                'regenerate': self.cache_regenerate}
+    
+    @torch.inference_mode()
+    def _predict_segments(self, segments: np.ndarray,
+                          batch_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Features plus deterministic actions and confidences for every segment, one batch at a time."""
+        # Observations don't depend on the actions taken, so the policy runs over batches of
+        # segments directly and the env replays the result. inference_mode covers the torch
+        # feature frontend as well as the policy
+        n_frames = 1 + self.preprocessor.segment_length // 512
+        features = np.empty((len(segments), 128, n_frames), dtype=np.float16)  # As the env stores them
+        actions = np.empty(len(segments), dtype=np.int8)
+        confidences = np.empty(len(segments), dtype=np.float32)
+        for start in range(0, len(segments), batch_size):
+            stop = start + batch_size
+            batch = self.preprocessor.batch_extract_features(segments[start:stop])[:, None]
+            features[start:stop] = batch[:, 0]
+            if self._ort is not None:
+                actions[start:stop], confidences[start:stop] = self.predict_batch_ort(batch)
+            else:
+                actions[start:stop], confidences[start:stop] = self.agent.predict_batch(
+                    batch, deterministic=True
+                )
+        return features, actions, confidences
+    
+    def _run_episode(self, segments: np.ndarray, features: np.ndarray,
+                     actions: np.ndarray, confidences: np.ndarray) -> Dict:
+        """Replay per-segment predictions through the env; results in the evaluate_episode format."""
+        env = ApneaDetectionEnv(
+            audio_segments=segments,
+            labels=[0] * len(segments),  # Unknown labels for custom audio
+            features=features
+        )
+        rewards = env.replay(actions)
+        n = len(rewards)
+        return ApneaRLAgent.summarize_episode(actions[:n], confidences[:n], rewards, env.get_episode_results())
+    
+    def test_audio_file(self, audio_path: str, segment_duration: float = 10.0,
+                        batch_size: int = 256) -> Dict:
         """Test a single audio file for apnea detection."""
-        if self.agent is None:
+        if self.agent is None and self._ort is None:
             raise ValueError("Agent not loaded. Please train the agent first.")
         
         print(f"Testing audio file: {audio_path}")
         
-        # Load audio
+        # Load and segment audio (or reuse the cached segments of an identical file)
         try:
-            audio, sr = self.preprocessor.load_audio(audio_path)
-            print(f"Audio loaded: {len(audio)} samples, {sr} Hz sample rate")
+            segments, sr = self._load_segments(audio_path)
         except Exception as e:
             print(f"Error loading audio: {e}")
             return {}
-        
-        # Segment audio
-        segments = self.preprocessor.segment_audio(audio, sr)
         print(f"Created {len(segments)} segments of {segment_duration} seconds each")
         
-        if not segments:
+        if len(segments) == 0:
             print("No valid segments extracted")
             return {}
         
-        # Create test environment
-        test_env = ApneaDetectionEnv(
-            audio_segments=segments,
-            labels=[0] * len(segments)  # Unknown labels for custom audio
-        )
-        
         # Run inference
-        results = self.agent.evaluate_episode(test_env)
+        features, actions, confidences = self._predict_segments(segments, batch_size)
+        results = self._run_episode(segments, features, actions, confidences)
         
         # Analyze results
         analysis = self._analyze_results(results, segments, sr, segment_duration)
         
         return analysis
     
+    def test_audio_files(self, audio_paths: List[str], n_workers: Optional[int] = None,
+                         segment_duration: float = 10.0, batch_size: int = 256) -> Dict[str, Dict]:
+        """Test many audio files: decode them in parallel, then run inference over all their segments.
+        
+        Returns each path's analysis (as from test_audio_file; empty if it couldn't be processed).
+        """
+        if self.agent is None and self._ort is None:
+            raise ValueError("Agent not loaded. Please train the agent first.")
+        
+        print(f"Testing {len(audio_paths)} audio files")
+        
+        # Decoding and resampling are CPU-bound and independent per file, so fan them out
+        # across processes; each worker builds its own preprocessor
+        loaded = Parallel(n_jobs=n_workers or os.cpu_count(), backend='loky')(
+            delayed(_preprocess_one)(
+                path, self.preprocessor.target_sr, self.preprocessor.segment_duration,
+                self._cache_options()
+            )
+            for path in audio_paths
+        )
+        
+        # One batched inference over every file's segments, split back per file afterwards
+        usable = [(path, segments, sr) for path, (segments, sr) in zip(audio_paths, loaded) if len(segments)]
+        analyses = {path: {} for path in audio_paths}
+        if not usable:
+            print("No valid segments extracted")
+            return analyses
+        
+        counts = [len(segments) for _, segments, _ in usable]
+        features, actions, confidences = self._predict_segments(
+            np.concatenate([segments for _, segments, _ in usable]), batch_size
+        )
+        bounds = np.cumsum([0] + counts)
+        for (path, segments, sr), start, stop in zip(usable, bounds[:-1], bounds[1:]):
+            results = self._run_episode(segments, features[start:stop],
+                                        actions[start:stop], confidences[start:stop])
+            analyses[path] = self._analyze_results(results, segments, sr, segment_duration)
+        
+        return analyses
+    
     def _analyze_results(self, results: Dict, segments: List[np.ndarray], 
                         sr: int, segment_duration: float) -> Dict:
         """Analyze the results and provide detailed insights."""
@@ -170,6 +347,9 @@ class CustomAudioTester:
             print("No analysis results to visualize")
             return
         
+        # Imported here so text-only use (e.g. generate_report) doesn't pay for matplotlib
+        import matplotlib.pyplot as plt
+        
         fig, axes = plt.subplots(2, 2, figsize=(15, 12))
         
         # Apnea events timeline
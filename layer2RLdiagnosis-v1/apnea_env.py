@@ -4,6 +4,28 @@ from gymnasium import spaces
 from typing import Tuple, Dict, Any
 from sklearn.model_selection import train_test_split
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to plain Python
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+
+@njit(cache=True, fastmath=True)
+def _diag_reward(true_label, confidence):
+    """DIAGNOSE reward for one segment; returns (reward, correctness, prediction)"""
+    prediction = 1 if confidence > 0.5 else 0
+    correctness = 1.0 if true_label == prediction else 0.0
+    
+    # Correctness minus a (reduced, 0.5x) calibration penalty plus a small exploration
+    # bonus for attempting a diagnosis, capped below at -0.5
+    calibration_penalty = 0.5 * (confidence - correctness) ** 2
+    reward = correctness - calibration_penalty + 0.1
+    return max(reward, -0.5), correctness, prediction
+
+
 class ApneaDetectionEnv(gym.Env):
     def __init__(self, features: np.ndarray, labels: np.ndarray, patient_ids: list, 
                  mode: str = 'train', max_episode_length: int = 100):
@@ -27,26 +49,41 @@ class ApneaDetectionEnv(gym.Env):
         # Environment state
         self.current_step = 0
         self.current_patient_idx = 0
-        self.episode_predictions = []
-        self.episode_confidences = []
-        self.episode_rewards = []
-        self.episode_timestamps = []  # Track when each event occurs
-        self.episode_event_details = []  # Store detailed event information
+        # Shared, read-only observation for steps past the end of the recording
+        self._zero_obs = np.zeros(self.observation_space.shape, dtype=np.float32)
+        self._zero_obs.setflags(write=False)
         
         # Split data by patient for episode structure
         self._organize_by_patient()
         
+        # Episode log as parallel arrays (at most one DIAGNOSE per segment) plus a cursor,
+        # allocated once and reused across episodes
+        capacity = max(max_episode_length, max(len(d['labels']) for d in self.patient_data.values()))
+        self._pred_buf = np.empty(capacity, dtype=np.int8)
+        self._conf_buf = np.empty(capacity, dtype=np.float32)
+        self._ts_buf = np.empty(capacity, dtype=np.float32)  # When each event occurs
+        self._reward_buf = np.empty(capacity, dtype=np.float32)
+        self._label_buf = np.empty(capacity, dtype=np.int8)
+        self._n_diag = 0
+        
     def _organize_by_patient(self):
         """Organize data by patient for episode-based training"""
-        unique_patients = list(set(self.patient_ids))
-        self.patient_data = {}
+        # Group segment indices by patient in one sort instead of a mask scan per patient
+        unique_patients, inverse = np.unique(np.asarray(self.patient_ids), return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        counts = np.bincount(inverse, minlength=len(unique_patients))
+        groups = np.split(order, np.cumsum(counts)[:-1])
         
-        for patient in unique_patients:
-            patient_mask = [pid == patient for pid in self.patient_ids]
+        self.patient_data = {}
+        for patient, indices in zip(unique_patients.tolist(), groups):
+            # One contiguous float32 block per patient, so observations are views, not casts
+            feats = np.ascontiguousarray(self.features[indices], dtype=np.float32)
             self.patient_data[patient] = {
-                'features': self.features[patient_mask],
-                'labels': self.labels[patient_mask],
-                'indices': np.where(patient_mask)[0]
+                'features': feats,
+                'labels': self.labels[indices],
+                'indices': indices,
+                # Features are static, so the per-segment confidence heuristic is computed once
+                'confidence': np.clip(np.abs(feats).mean(axis=1) / 100, 0.1, 0.9).astype(np.float32)
             }
         
         self.patient_list = list(self.patient_data.keys())
@@ -55,16 +92,12 @@ class ApneaDetectionEnv(gym.Env):
         super().reset(seed=seed)
         
         # Select random patient for episode
-        self.current_patient_idx = np.random.randint(0, len(self.patient_list))
+        self.current_patient_idx = int(self.np_random.integers(0, len(self.patient_list)))
         self.current_patient = self.patient_list[self.current_patient_idx]
         self.current_step = 0
         
         # Reset episode tracking
-        self.episode_predictions = []
-        self.episode_confidences = []
-        self.episode_rewards = []
-        self.episode_timestamps = []
-        self.episode_event_details = []
+        self._n_diag = 0
         
         # Get first observation
         obs = self._get_observation()
@@ -80,8 +113,8 @@ class ApneaDetectionEnv(gym.Env):
     def _get_observation(self) -> np.ndarray:
         """Get current audio segment features"""
         if self.current_step < len(self.patient_data[self.current_patient]['features']):
-            return self.patient_data[self.current_patient]['features'][self.current_step].astype(np.float32)
-        return np.zeros(self.observation_space.shape[0], dtype=np.float32)
+            return self.patient_data[self.current_patient]['features'][self.current_step]
+        return self._zero_obs
     
     def step(self, action: int) -> Tuple[np.ndarray, float, bool, bool, Dict[str, Any]]:
         reward = 0.0
@@ -106,45 +139,21 @@ class ApneaDetectionEnv(gym.Env):
                 
                 # Ensure confidence is reasonable (not always 0.100)
                 if confidence < 0.3:
-                    confidence = np.random.uniform(0.3, 0.9)  # More realistic range
+                    confidence = self.np_random.uniform(0.3, 0.9)  # More realistic range
                 
                 # Calculate improved ECE-inspired reward with better balancing
-                correctness = float(true_label == (confidence > 0.5))
-                
-                # Base reward for correct prediction
-                base_reward = correctness
-                
-                # Confidence calibration penalty (reduced severity)
-                calibration_penalty = 0.5 * (confidence - correctness) ** 2  # Reduced from 1.0 to 0.5
-                
-                # Exploration bonus for trying DIAGNOSE
-                exploration_bonus = 0.1  # Small bonus for attempting diagnosis
-                
-                # Final reward calculation
-                reward = base_reward - calibration_penalty + exploration_bonus
-                
-                # Ensure reward is not too negative (cap at -0.5)
-                reward = max(reward, -0.5)
+                reward, correctness, prediction = _diag_reward(int(true_label), float(confidence))
                 
                 # Store prediction for episode analysis
-                prediction = int(confidence > 0.5)
                 timestamp = self.current_step * 10.0  # 10 seconds per segment
                 
-                self.episode_predictions.append(prediction)
-                self.episode_confidences.append(confidence)
-                self.episode_rewards.append(reward)
-                self.episode_timestamps.append(timestamp)
-                
-                # Store detailed event information
-                event_detail = {
-                    'timestamp': timestamp,
-                    'prediction': prediction,
-                    'confidence': confidence,
-                    'true_label': true_label,
-                    'correctness': correctness,
-                    'reward': reward
-                }
-                self.episode_event_details.append(event_detail)
+                n = self._n_diag
+                self._pred_buf[n] = prediction
+                self._conf_buf[n] = confidence
+                self._ts_buf[n] = timestamp
+                self._reward_buf[n] = reward
+                self._label_buf[n] = true_label
+                self._n_diag = n + 1
                 
                 self.current_step += 1
                 
@@ -164,21 +173,44 @@ class ApneaDetectionEnv(gym.Env):
             'patient_id': self.current_patient,
             'step': self.current_step,
             'total_steps': len(self.patient_data[self.current_patient]['features']),
-            'episode_predictions': self.episode_predictions,
-            'episode_confidences': self.episode_confidences,
-            'episode_rewards': self.episode_rewards,
-            'episode_timestamps': self.episode_timestamps,
-            'episode_event_details': self.episode_event_details
+            'diagnosed_count': self._n_diag
         }
         
         return obs, reward, terminated, truncated, info
     
+    @property
+    def episode_predictions(self) -> np.ndarray:
+        """Predictions of this episode's DIAGNOSE steps (a view of the episode log)"""
+        return self._pred_buf[:self._n_diag]
+    
+    @property
+    def episode_confidences(self) -> np.ndarray:
+        return self._conf_buf[:self._n_diag]
+    
+    @property
+    def episode_rewards(self) -> np.ndarray:
+        return self._reward_buf[:self._n_diag]
+    
+    @property
+    def episode_timestamps(self) -> np.ndarray:
+        return self._ts_buf[:self._n_diag]
+    
+    @property
+    def episode_event_details(self) -> list:
+        """Detailed per-event records, built from the episode log on demand"""
+        return [
+            {'timestamp': float(ts), 'prediction': int(pred), 'confidence': float(conf),
+             'true_label': int(label), 'correctness': float(label == pred), 'reward': float(reward)}
+            for ts, pred, conf, label, reward in zip(
+                self.episode_timestamps, self.episode_predictions, self.episode_confidences,
+                self._label_buf[:self._n_diag], self.episode_rewards
+            )
+        ]
+    
     def _estimate_confidence(self, step: int) -> float:
         """Estimate confidence for current audio segment"""
-        # Simple heuristic: use feature magnitude as confidence proxy
-        features = self.patient_data[self.current_patient]['features'][step]
-        confidence = np.clip(np.mean(np.abs(features)) / 100, 0.1, 0.9)
-        return confidence
+        # Simple heuristic: feature magnitude as confidence proxy, precomputed per patient
+        return float(self.patient_data[self.current_patient]['confidence'][step])
     
     def _calculate_severity_score(self, predictions: np.ndarray, timestamps: np.ndarray) -> float:
         """
@@ -222,12 +254,12 @@ class ApneaDetectionEnv(gym.Env):
     
     def get_episode_metrics(self) -> Dict[str, Any]:
         """Get comprehensive episode metrics"""
-        if not self.episode_predictions:
+        if self._n_diag == 0:
             return {}
         
-        predictions = np.array(self.episode_predictions)
-        confidences = np.array(self.episode_confidences)
-        timestamps = np.array(self.episode_timestamps)
+        predictions = self.episode_predictions
+        confidences = self.episode_confidences
+        timestamps = self.episode_timestamps
         
         # Ensure we have the correct number of true labels
         # The true labels should match the number of predictions we made
@@ -247,18 +279,16 @@ class ApneaDetectionEnv(gym.Env):
         # ECE calculation
         n_bins = 10
         bin_boundaries = np.linspace(0, 1, n_bins + 1)
-        bin_lowers = bin_boundaries[:-1]
-        bin_uppers = bin_boundaries[1:]
-        
-        ece = 0.0
-        for bin_lower, bin_upper in zip(bin_lowers, bin_uppers):
-            in_bin = (confidences > bin_lower) & (confidences <= bin_upper)
-            if np.sum(in_bin) > 0:
-                bin_confidence = np.mean(confidences[in_bin])
-                bin_accuracy = np.mean(true_labels[in_bin])
-                ece += np.sum(in_bin) * np.abs(bin_confidence - bin_accuracy)
-        
-        ece /= n_predictions if n_predictions > 0 else 1
+        
+        # Bin index per prediction for (lower, upper] bins, then per-bin sums in one pass each
+        bin_idx = np.digitize(confidences, bin_boundaries, right=True) - 1
+        valid = (bin_idx >= 0) & (bin_idx < n_bins)
+        bin_idx = bin_idx[valid]
+        bin_conf_sum = np.bincount(bin_idx, weights=confidences[valid], minlength=n_bins)
+        bin_acc_sum = np.bincount(bin_idx, weights=true_labels[valid].astype(np.float64), minlength=n_bins)
+        
+        # bin_size * |bin_conf - bin_acc| == |bin_conf_sum - bin_acc_sum|; empty bins add 0
+        ece = float(np.abs(bin_conf_sum - bin_acc_sum).sum()) / max(n_predictions, 1)
         
         # Calculate severity score using frequency-based method
         severity_score = self._calculate_severity_score(predictions, timestamps)
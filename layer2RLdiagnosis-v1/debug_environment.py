@@ -98,7 +98,7 @@ def debug_environment():
             print(f"  DIAGNOSE action taken! Count: {diagnose_count}")
             
             # Check what was stored
-            if test_env.episode_predictions:
+            if len(test_env.episode_predictions):
                 last_prediction = test_env.episode_predictions[-1]
                 last_confidence = test_env.episode_confidences[-1]
                 print(f"  Last prediction: {last_prediction}, Confidence: {last_confidence:.3f}")
@@ -120,9 +120,9 @@ def debug_environment():
     print(f"\n📋 EPISODE METRICS")
     print("=" * 30)
     
-    if test_env.episode_predictions:
+    if len(test_env.episode_predictions):
         print(f"Total predictions: {len(test_env.episode_predictions)}")
-        print(f"Predictions: {test_env.episode_predictions}")
+        print(f"Predictions: {test_env.episode_predictions.tolist()}")
         print(f"Confidences: {[f'{c:.3f}' for c in test_env.episode_confidences]}")
         print(f"Timestamps: {[f'{t:.1f}s' for t in test_env.episode_timestamps]}")
         
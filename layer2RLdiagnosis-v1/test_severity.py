@@ -41,17 +41,12 @@ def test_severity_calculation():
         # Distribute apnea events throughout the night (not all at once)
         apnea_positions = np.linspace(0, n_samples-1, n_apnea_events, dtype=int)
         
-        for step in range(n_samples):
-            if step in apnea_positions:
-                # Simulate apnea detection
-                env.episode_predictions.append(1)
-                env.episode_confidences.append(0.8)
-                env.episode_timestamps.append(step * 10.0)
-            else:
-                # Simulate normal detection
-                env.episode_predictions.append(0)
-                env.episode_confidences.append(0.7)
-                env.episode_timestamps.append(step * 10.0)
+        # Write one DIAGNOSE per step straight into the env's episode log
+        is_apnea = np.isin(np.arange(n_samples), apnea_positions)
+        env._pred_buf[:n_samples] = is_apnea  # Apnea detection where simulated, normal elsewhere
+        env._conf_buf[:n_samples] = np.where(is_apnea, 0.8, 0.7)
+        env._ts_buf[:n_samples] = np.arange(n_samples) * 10.0
+        env._n_diag = n_samples
         
         # Get metrics
         metrics = env.get_episode_metrics()